@@ -8,11 +8,13 @@ readonly DISTANCE="${DISTANCE:-l2-squared}"
 readonly QUANTIZATION="${QUANTIZATION:-none}"
 readonly MULTIVECTOR_DATASET="${MULTIVECTOR_DATASET:-false}"
 readonly MULTIVECTOR_IMPLEMENTATION="${MULTIVECTOR_IMPLEMENTATION:-regular}"
+readonly MULTIVECTOR_DIM="${MULTIVECTOR_DIM:-128}"
 readonly WEAVIATE_VERSION="${WEAVIATE_VERSION:-}"
 readonly CLOUD_PROVIDER="${CLOUD_PROVIDER:-}"
 readonly MACHINE_TYPE="${MACHINE_TYPE:-}"
 readonly OS="${OS:-}"
 readonly REQUIRED_RECALL="${REQUIRED_RECALL:-}"
+readonly COLD_START="${COLD_START:-false}"
 
 # Constants
 readonly WEAVIATE_COMPOSE_FILE="apps/weaviate-no-restart-on-crash/docker-compose.yml"
@@ -101,6 +103,30 @@ restart_weaviate() {
     wait_for_weaviate
 }
 
+# Restart Weaviate and query from the moment it is ready until the caches are warm
+run_cold_start() {
+    local labels="$1"
+    local started_at
+    started_at=$(date +%s.%N)
+
+    log_info "Restarting Weaviate for cold start measurement..."
+    # the benchmark polls for readiness itself, so it can query the instant Weaviate is ready
+    docker run --network host \
+        -v "$PWD/datasets:/datasets" \
+        -v "$PWD/results:/workdir/results" \
+        "$ANNBENCHMARKS_IMAGE" \
+        python3 cold_start.py \
+        -v "/datasets/${DATASET}.hdf5" \
+        --started-at "$started_at" \
+        --ready-timeout "$WEAVIATE_READY_TIMEOUT" \
+        --labels "$labels" &
+    local cold_start_pid=$!
+
+    docker compose -f "$WEAVIATE_COMPOSE_FILE" start weaviate
+    wait $cold_start_pid
+    wait_for_weaviate
+}
+
 # Download dataset if not exists
 download_dataset() {
     log_info "Checking dataset availability..."
@@ -128,7 +154,7 @@ download_dataset() {
 # Get multivector flag
 get_multivector_flag() {
     if [ "$MULTIVECTOR_DATASET" = "true" ]; then
-        echo "-mv"
+        echo "-mv --multivector-dim $MULTIVECTOR_DIM"
         if [ "$MULTIVECTOR_IMPLEMENTATION" = "muvera" ]; then
             echo "-mi muvera"
         fi
@@ -256,7 +282,11 @@ main() {
     # Restart and run query-only benchmark
     log_info "Initial run complete, now restart Weaviate"
     stop_weaviate
-    restart_weaviate
+    if [ "$COLD_START" = "true" ] && [ "$MULTIVECTOR_DATASET" != "true" ]; then
+        run_cold_start "$(build_benchmark_labels "true")"
+    else
+        restart_weaviate
+    fi
     
     log_info "Weaviate ready, waiting ${CACHE_WARMUP_DELAY}s for caches to be hot"
     sleep $CACHE_WARMUP_DELAY
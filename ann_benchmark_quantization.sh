@@ -7,6 +7,7 @@ distance=${DISTANCE:-"l2-squared"}
 quantization=${QUANTIZATION:-"none"}
 multivector=${MULTIVECTOR_DATASET:-"false"}
 rq_bits=${RQ_BITS:-"8"}
+multivector_dim=${MULTIVECTOR_DIM:-"128"}
 
 function wait_weaviate() {
   echo "Wait for Weaviate to be ready"
@@ -53,7 +54,7 @@ mkdir -p datasets
 )
 
 if [ "$multivector" = true ]; then
-  multivector_flag="-mv"
+  multivector_flag="-mv --multivector-dim $multivector_dim"
 else
   multivector_flag=""
 fi
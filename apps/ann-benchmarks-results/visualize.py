@@ -2,17 +2,26 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import pandas as pd
 
-import os, glob
-import json
+import os, sys
 
-datapoints = []
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ann-benchmarks"))
+from results_store import load_results
 
-path = "./results"
-for filename in glob.glob(os.path.join(path, "*.json")):
-    with open(os.path.join(os.getcwd(), filename), "r") as f:
-        parsed = json.loads(f.read())
-        datapoints += parsed
-df = pd.DataFrame(datapoints)
+# only files added since the last invocation are parsed, the rest comes from the store
+df = load_results(
+    "./results",
+    columns=[
+        "run_id",
+        "after_restart",
+        "ef",
+        "heap_mb",
+        "recall",
+        "qps",
+        "pq",
+        "maxConnections",
+        "machine_type",
+    ],
+)
 df["time"] = df["run_id"].astype("int")
 
 
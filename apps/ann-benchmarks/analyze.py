@@ -1,19 +1,19 @@
-import pandas as pd
-import os, glob, sys
-import json
+import os
 import unittest
 
+from regression import baseline_rows
+from results_store import load_results
+
 
 class TestResults(unittest.TestCase):
     def setUp(self):
-        datapoints = []
+        self.df = load_results("./results")
+        if "workload" in self.df:
+            # mixed, delete and cold start rows aren't comparable with the static query runs
+            self.df = self.df[self.df["workload"].isna()]
 
-        path = "./results"
-        for filename in glob.glob(os.path.join(path, "*.json")):
-            with open(os.path.join(os.getcwd(), filename), "r") as f:
-                parsed = json.loads(f.read())
-                datapoints += parsed
-        self.df = pd.DataFrame(datapoints)
+    def has_column(self, column):
+        return column in self.df and not self.df[column].isna().all()
 
     def test_max_recall(self):
         required_recall = 0.992
@@ -28,9 +28,11 @@ class TestResults(unittest.TestCase):
 
     def test_recall_before_after(self):
         allowed_delta = 0.02
+        # async, pipelined, clientless, filtered or concurrent rows would skew the means
+        df = baseline_rows(self.df)
 
-        mean_recall_before = self.df.loc[self.df["after_restart"] == "false", "recall"].mean()
-        mean_recall_after = self.df.loc[self.df["after_restart"] == "true", "recall"].mean()
+        mean_recall_before = df.loc[df["after_restart"] == "false", "recall"].mean()
+        mean_recall_after = df.loc[df["after_restart"] == "true", "recall"].mean()
 
         delta = abs(mean_recall_before - mean_recall_after)
         self.assertTrue(
@@ -40,8 +42,9 @@ class TestResults(unittest.TestCase):
 
     def test_qps_before_after(self):
         allowed_delta = 0.25
-        mean_qps_before = self.df.loc[self.df["after_restart"] == "false", "qps"].mean()
-        mean_qps_after = self.df.loc[self.df["after_restart"] == "true", "qps"].mean()
+        df = baseline_rows(self.df)
+        mean_qps_before = df.loc[df["after_restart"] == "false", "qps"].mean()
+        mean_qps_after = df.loc[df["after_restart"] == "true", "qps"].mean()
 
         min_val, max_val = min(mean_qps_before, mean_qps_after), max(
             mean_qps_before, mean_qps_after
@@ -51,6 +54,41 @@ class TestResults(unittest.TestCase):
             f"qps before and after restart are not within the allowed delta of {allowed_delta}, got before={mean_qps_before}, after={mean_qps_after}",
         )
 
+    def test_p99_before_after(self):
+        if not self.has_column("p99"):
+            self.skipTest("results do not contain latency percentiles")
+
+        allowed_delta = 0.5
+        ad_env = os.getenv("ALLOWED_P99_DELTA")
+        if ad_env is not None and ad_env != "":
+            allowed_delta = float(ad_env)
+        df = baseline_rows(self.df)
+        mean_p99_before = df.loc[df["after_restart"] == "false", "p99"].mean()
+        mean_p99_after = df.loc[df["after_restart"] == "true", "p99"].mean()
+
+        self.assertTrue(
+            mean_p99_after < mean_p99_before * (1 + allowed_delta),
+            f"p99 latency after restart is more than {allowed_delta} above the one before restart, got before={mean_p99_before}, after={mean_p99_after}",
+        )
+
+    def test_p99_per_ef_before_after(self):
+        if not self.has_column("p99"):
+            self.skipTest("results do not contain latency percentiles")
+
+        allowed_delta = 1.0
+        # same api, concurrency and filter on both sides, only efs measured before and after
+        df = baseline_rows(self.df)
+        p99 = df.groupby(["ef", "after_restart"])["p99"].mean().unstack()
+        if "false" not in p99 or "true" not in p99:
+            self.skipTest("results do not contain runs before and after restart")
+        p99 = p99[["false", "true"]].dropna()
+
+        for ef, row in p99.iterrows():
+            self.assertTrue(
+                row["true"] < row["false"] * (1 + allowed_delta),
+                f"p99 latency at ef={ef} after restart is more than {allowed_delta} above the one before restart, got before={row['false']}, after={row['true']}",
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
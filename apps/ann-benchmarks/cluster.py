@@ -0,0 +1,133 @@
+import itertools
+import json
+import threading
+import time
+import urllib.request
+from typing import NamedTuple
+import numpy as np
+import weaviate
+
+from results_store import store_run
+from weaviate_import import CLASS_NAME
+
+# the multi-node compose files in apps/weaviate map node i to these ports + i
+HTTP_PORT = 8080
+GRPC_PORT = 50051
+PPROF_PORT = 6060
+
+
+class Node(NamedTuple):
+    host: str
+    http_port: int
+    grpc_port: int
+    pprof_port: int
+
+    @property
+    def origin(self):
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def pprof_origin(self):
+        return f"http://{self.host}:{self.pprof_port}"
+
+
+def parse_nodes(spec):
+    """Parses "host:http_port[:grpc_port[:pprof_port]],..." into nodes.
+
+    Missing ports are derived from the offset of the http port to 8080, which matches the
+    port mappings of the compose files in apps/weaviate (8081 -> 50052 and 6061).
+    """
+    nodes = []
+    for endpoint in spec.split(","):
+        host, *ports = endpoint.split(":")
+        http_port = int(ports[0]) if ports else HTTP_PORT
+        offset = http_port - HTTP_PORT
+        grpc_port = int(ports[1]) if len(ports) > 1 else GRPC_PORT + offset
+        pprof_port = int(ports[2]) if len(ports) > 2 else PPROF_PORT + offset
+        nodes.append(Node(host or "localhost", http_port, grpc_port, pprof_port))
+    return nodes
+
+
+def connect(node):
+    return weaviate.connect_to_local(host=node.host, port=node.http_port, grpc_port=node.grpc_port)
+
+
+class BalancedCollection:
+    """Spreads queries round-robin across the same collection on several nodes.
+
+    Only `query` rotates; everything else (config updates, data) goes to the first node,
+    so it can be passed wherever a single collection is expected.
+    """
+
+    def __init__(self, collections):
+        self.collections = collections
+        self._next = itertools.cycle(collections)
+        self._lock = threading.Lock()
+
+    @property
+    def query(self):
+        with self._lock:
+            return next(self._next).query
+
+    def __getattr__(self, name):
+        return getattr(self.collections[0], name)
+
+
+def fetch_nodes(origin, class_name=CLASS_NAME, timeout=10):
+    """Returns the verbose node stats of all nodes from /v1/nodes, restricted to `class_name`."""
+    url = f"{origin}/v1/nodes?output=verbose&collection={class_name}"
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return json.loads(resp.read())["nodes"]
+
+
+def snapshot(origin, class_name=CLASS_NAME):
+    """Returns one sample per node and one per shard of `class_name`."""
+    now = time.time()
+    node_samples = []
+    shard_samples = []
+    for node in fetch_nodes(origin, class_name):
+        shards = [s for s in node.get("shards") or [] if s.get("class") == class_name]
+        node_samples.append(
+            {
+                "t": now,
+                "node": node["name"],
+                "status": node.get("status"),
+                "objects": sum(s.get("objectCount", 0) for s in shards),
+                "shard_count": len(shards),
+            }
+        )
+        for shard in shards:
+            shard_samples.append(
+                {
+                    "t": now,
+                    "node": node["name"],
+                    "shard": shard["name"],
+                    "objects": shard.get("objectCount", 0),
+                    "vector_queue": shard.get("vectorQueueLength", 0),
+                }
+            )
+    return node_samples, shard_samples
+
+
+def summary(node_samples, shard_samples):
+    """Cluster-level stats stored with every result row.
+
+    The imbalance is the largest shard relative to the mean shard size, 1.0 is a perfect
+    split of the objects.
+    """
+    objects = np.array([s["objects"] for s in shard_samples], dtype=np.float64)
+    return {
+        "cluster_size": len(node_samples),
+        "shard_objects_min": int(objects.min()) if len(objects) else 0,
+        "shard_objects_max": int(objects.max()) if len(objects) else 0,
+        "shard_imbalance": float(objects.max() / objects.mean()) if objects.sum() else 1.0,
+    }
+
+
+def store(run_id, node_samples, shard_samples, path="./results"):
+    store_run(
+        run_id,
+        "cluster",
+        samples={"node_samples": node_samples, "shard_samples": shard_samples},
+        path=path,
+    )
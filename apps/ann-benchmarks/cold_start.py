@@ -0,0 +1,250 @@
+import argparse
+import os
+import time
+import urllib.request
+import h5py
+import numpy as np
+import weaviate
+from weaviate.connect import ConnectionParams
+from loguru import logger
+
+from latency import bucket, latency_summary
+from regression import baseline_rows
+from results_store import load_results, store_run
+from weaviate_query import search_grpc, class_name
+
+WEAVIATE_ORIGIN = "http://localhost:8080"
+GRPC_PORT = 50051
+READY_PATH = "/v1/.well-known/ready"
+# pause after a failed query so a node that is still loading isn't hammered
+ERROR_BACKOFF = 0.01
+
+
+def wait_until_ready(origin, started_at, timeout=600, poll=0.05):
+    """Polls the ready endpoint and returns the time it first answered with success."""
+    while True:
+        try:
+            with urllib.request.urlopen(f"{origin}{READY_PATH}", timeout=1):
+                return time.time()
+        except OSError:
+            pass
+        if time.time() - started_at > timeout:
+            raise TimeoutError(f"weaviate not ready after {timeout}s")
+        time.sleep(poll)
+
+
+def warm_baseline(ef=None, dataset_file=None, results_dir="./results"):
+    """Returns the ef and mean latency of the latest warm run (before restart).
+
+    Without `ef` it is the largest ef of that run, the one an ef sweep leaves the index at.
+    Returns (ef, None) if there is no such run.
+    """
+    df = baseline_rows(load_results(results_dir))
+    if len(df) == 0 or "ef" not in df:
+        return ef, None
+    if "after_restart" in df:
+        df = df[df["after_restart"].astype(str) != "true"]
+    if dataset_file is not None and "dataset_file" in df:
+        df = df[df["dataset_file"] == dataset_file]
+    df = df[df["run_id"] == df["run_id"].max()]
+    ef = ef if ef is not None else (df["ef"].max() if len(df) else None)
+    df = df[df["ef"] == ef]
+    if len(df) == 0:
+        return ef, None
+    return int(ef), float(df["mean"].mean())
+
+
+def unconnected_client(origin):
+    """A client for `origin` that only connects (and checks the server) on `connect()`."""
+    host, port = origin.rsplit("//", 1)[1].split(":")
+    return weaviate.WeaviateClient(
+        connection_params=ConnectionParams.from_params(
+            http_host=host,
+            http_port=int(port),
+            http_secure=False,
+            grpc_host=host,
+            grpc_port=GRPC_PORT,
+            grpc_secure=False,
+        )
+    )
+
+
+def windows(records, window):
+    """Aggregates (t, took, ok) query records into `window` second buckets."""
+    out = []
+    for w, rows in enumerate(bucket(records, window)):
+        ok = [r[1] for r in rows if r[2]]
+        out.append(
+            {
+                "elapsed_s": w * window,
+                "phase": "cold_start",
+                **latency_summary(ok),
+                "qps": len(ok) / window,
+                "queries": len(ok),
+                "errors": len(rows) - len(ok),
+            }
+        )
+    return out
+
+
+def _warm_from(samples, threshold):
+    """Index of the first window from which on every window is warm, None if never."""
+    warm = None
+    for i, s in enumerate(samples):
+        if s["errors"] == 0 and s["queries"] > 0 and s["mean"] <= threshold:
+            warm = i if warm is None else warm
+        else:
+            warm = None
+    return warm
+
+
+def run_cold_start(
+    client,
+    vectors,
+    duration=300,
+    window=1.0,
+    tolerance=0.1,
+    stable_windows=5,
+    limit=10,
+    baseline=None,
+    ready_at=None,
+):
+    """Queries in a closed loop from the moment the node is ready and records a time series.
+
+    Stops once the last `stable_windows` windows are all within `tolerance` of the warm
+    `baseline` latency, or after `duration` seconds. Without a baseline it runs the full
+    duration and takes the median latency of the last quarter of the windows as warm.
+    Failed and empty searches (e.g. shards still loading) count as errors.
+    The time series starts at `ready_at` (default now), so windows and the time to warm are
+    relative to the moment the node reported ready.
+    """
+    collection = client.collections.get(class_name)
+    start = ready_at or time.time()
+    records = []
+    current = 0
+    while time.time() - start < duration:
+        before = time.time()
+        try:
+            res = search_grpc(
+                collection, vectors[len(records) % len(vectors)].tolist(), limit=limit
+            )
+            ok = len(res["ids"]) > 0
+        except Exception as e:
+            logger.debug(f"cold start query failed: {e}")
+            ok = False
+        records.append((before - start, time.time() - before, ok))
+        if not ok:
+            time.sleep(ERROR_BACKOFF)
+        if baseline is None or int(records[-1][0] // window) == current:
+            continue
+        # a window was completed, check whether the last ones are all warm
+        current = int(records[-1][0] // window)
+        samples = windows(records, window)[:-1]
+        if (
+            len(samples) >= stable_windows
+            and _warm_from(samples[-stable_windows:], baseline * (1 + tolerance)) == 0
+        ):
+            break
+    samples = windows(records, window)
+    if baseline is None:
+        tail = [s["mean"] for s in samples[-max(1, len(samples) // 4) :] if s["queries"]]
+        baseline = float(np.median(tail)) if tail else float("nan")
+    return samples, baseline
+
+
+def summary(samples, baseline, window, ready_seconds, tolerance=0.1):
+    """Time to ready and to warm, and the area of the degradation until warm.
+
+    The degradation is given as the extra latency summed over all queries before the node
+    was warm, and as the queries a warm node would have answered in the same time but the
+    cold one did not (including errors).
+    """
+    warm = _warm_from(samples, baseline * (1 + tolerance))
+    cold = samples if warm is None else samples[:warm]
+    return {
+        "time_to_ready_seconds": ready_seconds,
+        "time_to_warm_seconds": warm * window if warm is not None else float("nan"),
+        "warm_mean": baseline,
+        "cold_first_mean": next((s["mean"] for s in samples if s["queries"]), float("nan")),
+        "cold_errors": sum(s["errors"] for s in samples),
+        "degradation_excess_seconds": sum(
+            max(0.0, s["mean"] - baseline) * s["queries"] for s in cold if s["queries"]
+        ),
+        "degradation_lost_queries": sum(max(0.0, window / baseline - s["queries"]) for s in cold),
+        "tolerance": tolerance,
+        "window_s": window,
+    }
+
+
+def store(run_id, samples, row, path="./results"):
+    store_run(run_id, "coldstart", [row], {"coldstart_samples": samples}, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="measure queries from the moment a (re)started node reports ready until warm"
+    )
+    parser.add_argument("-v", "--vectors", required=True)
+    parser.add_argument("--origin", default=WEAVIATE_ORIGIN)
+    parser.add_argument("--started-at", type=float, help="unix time of the (re)start, default now")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--duration", type=float, default=300)
+    parser.add_argument("--window", type=float, default=1.0)
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--stable-windows", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument(
+        "--ef",
+        type=int,
+        help="ef the index was left with, default the largest ef of the latest warm run",
+    )
+    parser.add_argument(
+        "--baseline-latency",
+        type=float,
+        help="warm mean latency in seconds, default from the latest run before the restart",
+    )
+    parser.add_argument("-l", "--labels")
+    args = parser.parse_args()
+
+    started_at = args.started_at or time.time()
+    labels = dict(pair.split("=", 1) for pair in args.labels.split(",")) if args.labels else {}
+    labels["dataset_file"] = os.path.basename(args.vectors)
+    with h5py.File(args.vectors) as f:
+        vectors = f["test"][:]
+
+    # everything but the queries is prepared before the node is ready
+    ef, baseline = warm_baseline(args.ef, labels["dataset_file"])
+    baseline = args.baseline_latency or baseline
+    client = unconnected_client(args.origin)
+    logger.info(f"waiting for weaviate, will query at ef={ef}, warm baseline latency {baseline}")
+
+    ready_at = wait_until_ready(args.origin, started_at, args.ready_timeout)
+    try:
+        client.connect()
+        samples, baseline = run_cold_start(
+            client,
+            vectors,
+            args.duration,
+            args.window,
+            args.tolerance,
+            args.stable_windows,
+            args.limit,
+            baseline,
+            ready_at,
+        )
+    finally:
+        client.close()
+    logger.info(f"ready after {ready_at - started_at:.2f}s")
+
+    run_id = f"{int(ready_at)}"
+    row = {
+        "api": "grpc",
+        "workload": "cold_start",
+        "ef": ef,
+        "limit": args.limit,
+        **summary(samples, baseline, args.window, ready_at - started_at, args.tolerance),
+        "run_id": run_id,
+        **labels,
+    }
+    logger.info(f"cold start: {row}")
+    store(run_id, samples, row)
@@ -0,0 +1,89 @@
+import numpy as np
+
+# rows per block for datasets that are not chunked, or as target size for chunked ones
+DEFAULT_BLOCK_ROWS = 10000
+
+
+def block_rows(dataset, target_rows=DEFAULT_BLOCK_ROWS):
+    """Returns the rows per block, a multiple of the HDF5 chunk rows close to `target_rows`."""
+    chunks = getattr(dataset, "chunks", None)
+    if chunks is None:
+        return target_rows
+    return max(1, target_rows // chunks[0]) * chunks[0]
+
+
+def iter_blocks(dataset, start=0, stop=None, rows=None):
+    """Yields (offset, block) for dataset[start:stop], reading one block at a time.
+
+    Block boundaries are aligned to the chunk layout of the dataset so that every HDF5
+    chunk is read (and decompressed) exactly once.
+    """
+    stop = len(dataset) if stop is None else min(stop, len(dataset))
+    rows = rows or block_rows(dataset)
+    pos = start
+    while pos < stop:
+        end = min(stop, (pos // rows + 1) * rows)
+        yield pos, dataset[pos:end]
+        pos = end
+
+
+def as_multivector(sample, dim):
+    """Views a flat multivector sample as (tokens x dim) without copying it."""
+    return np.asarray(sample).reshape(-1, dim)
+
+
+def iter_vectors(dataset, start=0, stop=None, multivector_dim=None):
+    """Yields (i, vector) for dataset[start:stop] backed by block reads.
+
+    With `multivector_dim` set every row is returned as a (tokens x dim) view.
+    """
+    for offset, block in iter_blocks(dataset, start, stop):
+        for j, row in enumerate(block):
+            if multivector_dim is not None:
+                row = as_multivector(row, multivector_dim)
+            yield offset + j, row
+
+
+def load_vectors(dataset, multivector_dim=None):
+    """Reads a whole (small) dataset such as the test set into memory.
+
+    Multivector samples are returned as a list of (tokens x dim) views.
+    """
+    vectors = dataset[:]
+    if multivector_dim is not None:
+        vectors = [as_multivector(sample, multivector_dim) for sample in vectors]
+    return vectors
+
+
+def multivector_dim(f, sample_rows=DEFAULT_BLOCK_ROWS):
+    """Returns the token dimension of a multivector dataset file from its "dimension" attribute.
+
+    The flat samples don't determine it (any common divisor of their lengths fits), so a file
+    without the attribute, or with one that doesn't divide the first train rows and the test
+    set, raises a ValueError; pass the dimension explicitly then.
+    """
+    dim = f.attrs.get("dimension")
+    if dim is None:
+        raise ValueError(
+            f'{f.filename} has no "dimension" attribute, the token dimension is ambiguous'
+        )
+    lengths = [len(row) for row in f["train"][:sample_rows]] + [len(row) for row in f["test"]]
+    bad = next((length for length in lengths if length % int(dim) != 0), None)
+    if bad is not None:
+        raise ValueError(
+            f'the "dimension" attribute {int(dim)} of {f.filename} doesn\'t divide a sample of length {bad}'
+        )
+    return int(dim)
+
+
+def token_stats(counts):
+    """Summarizes the token counts of the imported multivector documents."""
+    counts = np.asarray(counts)
+    if len(counts) == 0:
+        return {}
+    return {
+        "doc_tokens_mean": float(counts.mean()),
+        "doc_tokens_p50": float(np.median(counts)),
+        "doc_tokens_max": int(counts.max()),
+        "doc_tokens_total": int(counts.sum()),
+    }
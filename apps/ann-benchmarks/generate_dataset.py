@@ -0,0 +1,135 @@
+import argparse
+import os
+import time
+import numpy as np
+import h5py
+from loguru import logger
+
+from dataset_reader import DEFAULT_BLOCK_ROWS
+from ground_truth import DISTANCES, exact_neighbors
+
+DISTRIBUTIONS = ["clustered", "anisotropic"]
+# distance names used by the ann-benchmarks files for the distances we support
+ANN_BENCHMARKS_DISTANCES = {"l2-squared": "euclidean", "cosine": "angular", "dot": "dot"}
+# every stream draws from its own seed sequence, so train and test never share vectors
+STREAMS = {"train": 0, "test": 1}
+
+
+class Generator:
+    """Draws vectors from a seeded mixture of Gaussian clusters.
+
+    "clustered" uses isotropic clusters. "anisotropic" stretches every cluster along its
+    own axes (log-uniform scales) and rotates all of them by one random rotation, so the
+    dimensions are correlated like in real embeddings. Every block is drawn from its own
+    seed, so the same seed and block size always produce the same file.
+    """
+
+    def __init__(self, dim, clusters, distribution="clustered", spread=1.0, seed=0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"unknown distribution {distribution}, must be one of {DISTRIBUTIONS}")
+        self.dim = dim
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.centers = rng.normal(0, spread, (clusters, dim)).astype(np.float32)
+        self.weights = rng.dirichlet(np.full(clusters, 5.0))
+        self.scales = np.full((clusters, dim), 0.25 * spread, dtype=np.float32)
+        self.rotation = None
+        if distribution == "anisotropic":
+            self.scales = (
+                0.25 * spread * np.exp(rng.uniform(np.log(0.1), np.log(2.0), (clusters, dim)))
+            ).astype(np.float32)
+            self.rotation = np.linalg.qr(rng.normal(size=(dim, dim)))[0].astype(np.float32)
+
+    def block(self, stream, index, rows):
+        """Returns `rows` vectors of block `index` of the named stream (train, test)."""
+        rng = np.random.default_rng([self.seed, STREAMS[stream], index])
+        assignment = rng.choice(len(self.centers), rows, p=self.weights)
+        noise = rng.standard_normal((rows, self.dim), dtype=np.float32)
+        noise *= self.scales[assignment]
+        if self.rotation is not None:
+            noise = noise @ self.rotation
+        return self.centers[assignment] + noise
+
+
+def write_vectors(f, name, generator, count, rows=DEFAULT_BLOCK_ROWS):
+    """Streams `count` vectors into dataset `name`, chunked by `rows`, one block at a time."""
+    dataset = f.create_dataset(
+        name, (count, generator.dim), dtype=np.float32, chunks=(min(rows, count), generator.dim)
+    )
+    before = time.time()
+    for index, start in enumerate(range(0, count, rows)):
+        stop = min(count, start + rows)
+        dataset[start:stop] = generator.block(name, index, stop - start)
+        if index % 100 == 0:
+            logger.info(f"wrote {stop}/{count} {name} vectors")
+    logger.info(f"wrote {count} {name} vectors in {time.time() - before:.1f}s")
+    return dataset
+
+
+def generate(
+    path,
+    train,
+    test,
+    dim,
+    clusters,
+    distribution="clustered",
+    distance="l2-squared",
+    k=100,
+    seed=0,
+    rows=DEFAULT_BLOCK_ROWS,
+):
+    """Writes an ann-benchmarks style HDF5 file with train, test, neighbors and distances.
+
+    Memory stays bounded by one block of vectors plus the test set and its running top-k;
+    neighbors are computed with the blockwise exact search of the ground truth module.
+    """
+    if distance not in DISTANCES:
+        raise ValueError(f"unsupported distance {distance}, must be one of {DISTANCES}")
+    generator = Generator(dim, clusters, distribution, seed=seed)
+    tmp = f"{path}.tmp"
+    with h5py.File(tmp, "w") as f:
+        f.attrs["type"] = "dense"
+        f.attrs["distance"] = ANN_BENCHMARKS_DISTANCES[distance]
+        f.attrs["dimension"] = dim
+        f.attrs["point_type"] = "float"
+        f.attrs["generator"] = f"{distribution}, clusters={clusters}, seed={seed}"
+
+        train_set = write_vectors(f, "train", generator, train, rows)
+        queries = write_vectors(f, "test", generator, test, rows)[:]
+
+        neighbors, distances = exact_neighbors(train_set, queries, k, distance)
+        if distance == "l2-squared":
+            # ann-benchmarks files store euclidean, not squared, distances
+            distances = np.sqrt(distances)
+        f.create_dataset("neighbors", data=neighbors.astype(np.int32))
+        f.create_dataset("distances", data=distances.astype(np.float32))
+    os.replace(tmp, path)
+    logger.info(f"stored dataset in {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generate a synthetic HDF5 dataset")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("-n", "--train", type=int, default=1_000_000)
+    parser.add_argument("-t", "--test", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="clustered")
+    parser.add_argument("-d", "--distance", choices=DISTANCES, default="l2-squared")
+    parser.add_argument("-k", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    args = parser.parse_args()
+
+    generate(
+        args.output,
+        args.train,
+        args.test,
+        args.dim,
+        args.clusters,
+        args.distribution,
+        args.distance,
+        args.k,
+        args.seed,
+        args.block_rows,
+    )
@@ -0,0 +1,219 @@
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+import h5py
+from loguru import logger
+
+from dataset_reader import iter_blocks
+
+DISTANCES = ["l2-squared", "cosine", "dot"]
+# queries scored against one block of train vectors at a time, bounds the score matrix
+QUERY_BLOCK_ROWS = 1024
+# content hashes of HDF5 datasets by (path, name, size, mtime), see dataset_hash
+_dataset_hashes = {}
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _partial_scores(block, queries, distance):
+    """Scores a block of train vectors against the queries, smaller is closer.
+
+    For l2-squared the per-query constant |q|^2 is left out, it does not change the order.
+    """
+    scores = queries @ block.T
+    if distance == "l2-squared":
+        scores *= -2
+        scores += np.einsum("ij,ij->i", block, block)[None, :]
+    else:
+        np.negative(scores, out=scores)
+    return scores
+
+
+def _top_k(scores, ids, k):
+    """Returns the k smallest scores per row (and their ids), unsorted."""
+    if scores.shape[1] > k:
+        part = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    return scores, ids
+
+
+def _merge(best_scores, best_ids, scores, block_ids, k):
+    """Merges the scores of a block into the running top-k of each query.
+
+    Only candidates that beat the current k-th best of their query are considered, which
+    after the first few blocks is a tiny fraction of the block.
+    """
+    hits = scores < best_scores.max(axis=1)[:, None]
+    counts = hits.sum(axis=1)
+    width = counts.max()
+    if width == 0:
+        return best_scores, best_ids
+
+    if width > scores.shape[1] // 4:
+        ids = np.broadcast_to(block_ids, scores.shape)
+        candidate_scores, candidate_ids = _top_k(scores, ids, k)
+    else:
+        # flatnonzero on the raveled mask is much faster than a 2D nonzero
+        flat = np.flatnonzero(hits)
+        rows, cols = np.divmod(flat, scores.shape[1])
+        pos = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidate_scores = np.full((len(scores), width), np.inf, dtype=np.float32)
+        candidate_ids = np.full((len(scores), width), -1, dtype=np.int64)
+        candidate_scores[rows, pos] = scores[rows, cols]
+        candidate_ids[rows, pos] = block_ids[cols]
+
+    return _top_k(
+        np.concatenate([best_scores, candidate_scores], axis=1),
+        np.concatenate([best_ids, candidate_ids], axis=1),
+        k,
+    )
+
+
+def exact_neighbors(train, queries, k, distance, mask=None):
+    """Computes the exact top-k neighbors of every query by brute force.
+
+    Train vectors are read block by block and scored with one matmul per block of queries;
+    the running top-k is merged with argpartition. `mask` optionally restricts the search to
+    the train rows where it is True (filters, deletes). Returns (neighbors, distances) sorted
+    by distance, padded with -1/inf where fewer than k rows are allowed.
+    """
+    if distance not in DISTANCES:
+        raise ValueError(f"unsupported distance {distance}, must be one of {DISTANCES}")
+    if train.dtype == object:
+        raise ValueError("exact ground truth is not supported for multivector datasets")
+
+    queries = np.asarray(queries, dtype=np.float32)
+    if distance == "cosine":
+        queries = _normalize(queries)
+    best_scores = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+    before = time.time()
+    for offset, block in iter_blocks(train):
+        block = np.asarray(block, dtype=np.float32)
+        block_ids = np.arange(offset, offset + len(block))
+        if mask is not None:
+            allowed = mask[offset : offset + len(block)]
+            block, block_ids = block[allowed], block_ids[allowed]
+            if len(block) == 0:
+                continue
+        if distance == "cosine":
+            block = _normalize(block)
+
+        for q in range(0, len(queries), QUERY_BLOCK_ROWS):
+            scores = _partial_scores(block, queries[q : q + QUERY_BLOCK_ROWS], distance)
+            best_scores[q : q + QUERY_BLOCK_ROWS], best_ids[q : q + QUERY_BLOCK_ROWS] = _merge(
+                best_scores[q : q + QUERY_BLOCK_ROWS],
+                best_ids[q : q + QUERY_BLOCK_ROWS],
+                scores,
+                block_ids,
+                k,
+            )
+
+    order = np.argsort(best_scores, axis=1, kind="stable")
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    best_ids[np.isinf(best_scores)] = -1
+
+    if distance == "l2-squared":
+        distances = np.maximum(best_scores + np.einsum("ij,ij->i", queries, queries)[:, None], 0)
+    elif distance == "cosine":
+        distances = 1 + best_scores
+    else:
+        distances = best_scores
+    logger.info(
+        f"computed exact top-{k} for {len(queries)} queries against {len(train)} vectors in {time.time() - before:.1f}s"
+    )
+    return best_ids, distances
+
+
+def dataset_hash(dataset):
+    """Hashes the content of a dataset block by block.
+
+    The hash of an HDF5 dataset is memoized per file path, size and mtime, so a run computing
+    several ground truths (filters, deletes) reads the train set only once.
+    """
+    try:
+        stat = os.stat(dataset.file.filename)
+        memo_key = (
+            os.path.abspath(dataset.file.filename),
+            dataset.name,
+            stat.st_size,
+            stat.st_mtime,
+        )
+    except AttributeError:
+        memo_key = None
+    if memo_key in _dataset_hashes:
+        return _dataset_hashes[memo_key]
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((dataset.shape, str(dataset.dtype))).encode())
+    for _, block in iter_blocks(dataset):
+        h.update(np.ascontiguousarray(block).tobytes())
+    if memo_key is not None:
+        _dataset_hashes[memo_key] = h.hexdigest()
+    return h.hexdigest()
+
+
+def cache_key(train, queries, k, distance, mask=None):
+    """Identifies a ground truth by train set, query set, k, distance and mask."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(dataset_hash(train).encode())
+    h.update(np.ascontiguousarray(queries, dtype=np.float32).tobytes())
+    h.update(f"{k}-{distance}".encode())
+    if mask is not None:
+        h.update(np.packbits(mask).tobytes())
+    return h.hexdigest()
+
+
+def ground_truth(train, queries, k, distance, mask=None, cache_dir=None):
+    """Like exact_neighbors, but cached on disk in `cache_dir` if given."""
+    if cache_dir is None:
+        return exact_neighbors(train, queries, k, distance, mask)
+
+    filename = os.path.join(cache_dir, f"{cache_key(train, queries, k, distance, mask)}.npz")
+    if os.path.exists(filename):
+        logger.info(f"loading ground truth from {filename}")
+        with np.load(filename) as cached:
+            return cached["neighbors"], cached["distances"]
+
+    neighbors, distances = exact_neighbors(train, queries, k, distance, mask)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(filename, neighbors=neighbors, distances=distances)
+    logger.info(f"stored ground truth in {filename}")
+    return neighbors, distances
+
+
+def cache_dir_for(path):
+    """Ground truth of a dataset file is cached next to it."""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), "ground_truth")
+
+
+def load_neighbors(dataset, k, distance, cache_dir=None):
+    """Returns the top-k neighbors shipped with the dataset, or computes them if missing."""
+    if "neighbors" in dataset and dataset["neighbors"].shape[1] >= k:
+        return dataset["neighbors"][:, :k]
+
+    logger.info(f"dataset has no top-{k} neighbors, computing exact ground truth")
+    neighbors, _ = ground_truth(dataset["train"], dataset["test"][:], k, distance, None, cache_dir)
+    return neighbors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="precompute and cache exact ground truth")
+    parser.add_argument("-v", "--vectors", required=True)
+    parser.add_argument("-d", "--distance", required=True, choices=DISTANCES)
+    parser.add_argument("-k", type=int, default=100)
+    args = parser.parse_args()
+
+    with h5py.File(args.vectors, "r") as f:
+        ground_truth(
+            f["train"], f["test"][:], args.k, args.distance, None, cache_dir_for(args.vectors)
+        )
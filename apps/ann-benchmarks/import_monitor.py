@@ -0,0 +1,109 @@
+import json
+import multiprocessing
+import threading
+import time
+import urllib.request
+from loguru import logger
+
+import weaviate_import
+from results_store import store_run
+from weaviate_import import CLASS_NAME
+
+WEAVIATE_ORIGIN = "http://localhost:8080"
+
+
+def fetch_shards(origin, class_name=CLASS_NAME, timeout=10):
+    """Returns the verbose shard stats of `class_name` across all nodes from /v1/nodes."""
+    url = f"{origin}/v1/nodes?output=verbose&collection={class_name}"
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        nodes = json.loads(resp.read())["nodes"]
+    return [
+        shard
+        for node in nodes
+        for shard in node.get("shards") or []
+        if shard.get("class") == class_name
+    ]
+
+
+class ImportMonitor:
+    """Records a time series of the import while it runs.
+
+    Every `interval` seconds it samples the objects handed to the batch by the client
+    (across import processes), the objects the server counts and the vector queue
+    backlog of all shards, so both the insert throughput as the graph grows and the
+    indexing lag behind ingestion can be read from the samples.
+    """
+
+    def __init__(self, origin=WEAVIATE_ORIGIN, interval=5):
+        self.origin = origin
+        self.interval = interval
+        self.samples = []
+        self.counter = multiprocessing.get_context("spawn").Value("q", 0)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        weaviate_import.sent_counter = self.counter
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        weaviate_import.sent_counter = None
+        self._sample_once()
+
+    def _sample_once(self):
+        sent = self.counter.value
+        try:
+            shards = fetch_shards(self.origin)
+        except Exception as e:
+            logger.warning(f"could not sample shard stats: {e}")
+            return
+        now = time.time()
+        sample = {
+            "t": now,
+            "phase": "import",
+            "sent": sent,
+            "objects": sum(s.get("objectCount", 0) for s in shards),
+            "vector_queue": sum(s.get("vectorQueueLength", 0) for s in shards),
+            "indexing": sorted({s.get("vectorIndexingStatus", "") for s in shards}),
+        }
+        if self.samples:
+            last = self.samples[-1]
+            dt = now - last["t"]
+            sample["sent_per_second"] = (sent - last["sent"]) / dt if dt > 0 else 0
+            sample["objects_per_second"] = (
+                (sample["objects"] - last["objects"]) / dt if dt > 0 else 0
+            )
+        self.samples.append(sample)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._sample_once()
+            self._stop.wait(self.interval)
+
+    def summary(self):
+        """Import-level stats derived from the samples, stored with every result row.
+
+        The indexing lag is the time from the last object sent until the vector queues of
+        all shards were drained.
+        """
+        if not self.samples:
+            return {}
+        total = self.samples[-1]["sent"]
+        sent_done = next(s["t"] for s in self.samples if s["sent"] >= total)
+        drained = next(
+            (s["t"] for s in self.samples if s["t"] >= sent_done and s["vector_queue"] == 0),
+            self.samples[-1]["t"],
+        )
+        return {
+            "import_peak_vector_queue": max(s["vector_queue"] for s in self.samples),
+            "import_indexing_lag_seconds": drained - sent_done,
+        }
+
+    def store(self, run_id, path="./results"):
+        store_run(run_id, "imports", samples={"import_samples": self.samples}, path=path)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import time
+import weaviate
+from weaviate.backup.backup import BackupStatus, BackupStorage
+from loguru import logger
+
+from weaviate_import import CLASS_NAME, wait_for_all_shards_ready
+
+# requires ENABLE_MODULES=backup-filesystem and BACKUP_FILESYSTEM_PATH on the server
+BACKEND = BackupStorage.FILESYSTEM
+
+
+def index_key(dataset, **config):
+    """Identifies an index by the dataset it was built from and its build configuration.
+
+    The dataset is identified by file name, size and the shape/dtype of the train set
+    rather than by content, which would mean reading the whole file on every run. `config`
+    has to hold everything that changes the imported index, e.g. the multivector token
+    dimension and the number of objects imported before quantization is enabled.
+    """
+    train = dataset["train"]
+    identity = {
+        "dataset": os.path.basename(dataset.filename),
+        "size": os.path.getsize(dataset.filename),
+        "shape": list(train.shape),
+        "dtype": str(train.dtype),
+        **config,
+    }
+    digest = hashlib.blake2b(json.dumps(identity, sort_keys=True).encode(), digest_size=8)
+    return f"ann-index-{digest.hexdigest()}"
+
+
+def exists(client: weaviate.WeaviateClient, backup_id):
+    try:
+        return client.backup.get_create_status(backup_id, BACKEND).status == BackupStatus.SUCCESS
+    except Exception as e:
+        logger.debug(f"no usable backup {backup_id}: {e}")
+        return False
+
+
+def restore(client: weaviate.WeaviateClient, backup_id):
+    """Replaces the collection with the one in `backup_id`, returns the restore stats or None."""
+    if not exists(client, backup_id):
+        logger.info(f"index cache miss for {backup_id}")
+        return None
+
+    logger.info(f"index cache hit, restoring {backup_id}")
+    before = time.time()
+    client.collections.delete_all()
+    res = client.backup.restore(
+        backup_id, BACKEND, include_collections=[CLASS_NAME], wait_for_completion=True
+    )
+    if res.status != BackupStatus.SUCCESS:
+        logger.error(f"restoring {backup_id} failed: {res.error}")
+        return None
+    wait_for_all_shards_ready(client)
+    took = time.time() - before
+    logger.info(f"restored {backup_id} in {took:.1f}s")
+    return {"index_cache": backup_id, "index_restored": True, "restore_seconds": took}
+
+
+def store(client: weaviate.WeaviateClient, backup_id):
+    """Backs up the freshly imported collection under `backup_id`, returns the backup stats."""
+    before = time.time()
+    res = client.backup.create(
+        backup_id, BACKEND, include_collections=[CLASS_NAME], wait_for_completion=True
+    )
+    took = time.time() - before
+    if res.status != BackupStatus.SUCCESS:
+        logger.error(f"storing {backup_id} failed: {res.error}")
+        return {}
+    logger.info(f"stored index as {backup_id} in {took:.1f}s")
+    return {"index_cache": backup_id, "index_restored": False, "backup_seconds": took}
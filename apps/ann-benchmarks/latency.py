@@ -0,0 +1,31 @@
+import numpy as np
+
+PERCENTILES = {
+    "p50": 50,
+    "p90": 90,
+    "p99": 99,
+    "p999": 99.9,
+}
+
+
+def bucket(records, window):
+    """Groups records by the `window` second bucket of their first field (seconds since the
+    start), including the empty buckets up to the last one."""
+    buckets = {}
+    for record in records:
+        buckets.setdefault(int(record[0] // window), []).append(record)
+    return [buckets.get(w, []) for w in range(max(buckets) + 1 if buckets else 0)]
+
+
+def latency_summary(latencies):
+    """Summarizes per-query latencies (in seconds) into mean, tail percentiles and max."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    if len(latencies) == 0:
+        return {"mean": float("nan"), **{k: float("nan") for k in PERCENTILES}, "max": float("nan")}
+
+    values = np.percentile(latencies, list(PERCENTILES.values()))
+    return {
+        "mean": float(latencies.mean()),
+        **{k: float(v) for k, v in zip(PERCENTILES.keys(), values)},
+        "max": float(latencies.max()),
+    }
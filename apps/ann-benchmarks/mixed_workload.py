@@ -0,0 +1,252 @@
+import threading
+import time
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+from dataset_reader import iter_blocks
+from ground_truth import exact_neighbors
+from latency import bucket, latency_summary
+from recall import recall_at_k, result_ids
+from results_store import store_run
+from weaviate_query import search_grpc, set_ef, class_name
+
+OPERATIONS = ["query", "insert", "replace", "delete"]
+# new vectors are existing train vectors moved by this fraction of the per-dimension std
+NOISE = 0.05
+
+
+def parse_ratios(spec):
+    """Parses "query=0.8,insert=0.1,..." into normalized weights per operation."""
+    ratios = {op: 0.0 for op in OPERATIONS}
+    for pair in spec.split(","):
+        op, ratio = pair.split("=")
+        if op not in OPERATIONS:
+            raise ValueError(f"unknown operation {op}, must be one of {OPERATIONS}")
+        ratios[op] = float(ratio)
+    total = sum(ratios.values())
+    if total <= 0:
+        raise ValueError(f"invalid ratios {spec}")
+    return {op: r / total for op, r in ratios.items()}
+
+
+class LiveIndex:
+    """Local mirror of which vector every id holds while the collection is mutated.
+
+    The train set stays on disk; ids that were deleted or replaced are masked out of it and
+    inserted or replaced vectors are kept in memory, so an exact ground truth of the current
+    state can be computed at any time. An id that is being replaced or deleted stays reserved
+    until the write was acknowledged, so concurrent writes never race on the same id.
+    """
+
+    def __init__(self, train, distance):
+        self.train = train
+        self.distance = distance
+        self.count = len(train)
+        self.alive = np.ones(self.count, dtype=bool)
+        self.extra = {}
+        self.next_id = self.count
+        self.reserved = set()
+        self.lock = threading.Lock()
+        _, first = next(iter_blocks(train))
+        self.noise = NOISE * np.asarray(first, dtype=np.float32).std(axis=0)
+
+    def new_vector(self, rng):
+        row = np.asarray(self.train[int(rng.integers(self.count))], dtype=np.float32)
+        return row + self.noise * rng.standard_normal(len(self.noise), dtype=np.float32)
+
+    def reserve_alive(self, rng, attempts=10):
+        """Picks an alive id that no other write holds and reserves it until `release`."""
+        with self.lock:
+            for _ in range(attempts):
+                i = int(rng.integers(self.next_id))
+                if i in self.reserved:
+                    continue
+                if i in self.extra or (i < self.count and self.alive[i]):
+                    self.reserved.add(i)
+                    return i
+        return None
+
+    def release(self, i):
+        with self.lock:
+            self.reserved.discard(i)
+
+    def set(self, i, vector):
+        with self.lock:
+            if i < self.count:
+                self.alive[i] = False
+            self.extra[i] = vector
+
+    def delete(self, i):
+        with self.lock:
+            if i < self.count:
+                self.alive[i] = False
+            self.extra.pop(i, None)
+
+    def snapshot(self):
+        with self.lock:
+            return self.alive.copy(), dict(self.extra)
+
+    def neighbors(self, queries, k, snapshot):
+        """Exact top-k ids of `queries` against a snapshot of the live state."""
+        alive, extra = snapshot
+        ids, distances = exact_neighbors(self.train, queries, k, self.distance, alive)
+        if extra:
+            extra_ids = np.fromiter(extra.keys(), dtype=np.int64, count=len(extra))
+            rows, extra_distances = exact_neighbors(
+                np.stack(list(extra.values())), queries, k, self.distance
+            )
+            ids = np.concatenate([ids, np.where(rows >= 0, extra_ids[rows], -1)], axis=1)
+            distances = np.concatenate([distances, extra_distances], axis=1)
+            order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+            ids = np.take_along_axis(ids, order, axis=1)
+        return ids
+
+
+def _operation(collection, live, queries, op, rng, limit):
+    if op == "query":
+        return search_grpc(collection, queries[rng.integers(len(queries))].tolist(), limit=limit)
+    if op == "insert":
+        with live.lock:
+            i = live.next_id
+            live.next_id += 1
+        vector = live.new_vector(rng)
+        collection.data.insert(properties={"i": i}, vector=vector.tolist(), uuid=uuid.UUID(int=i))
+        live.set(i, vector)
+    elif op == "replace":
+        i = live.reserve_alive(rng)
+        if i is None:
+            return None
+        try:
+            vector = live.new_vector(rng)
+            collection.data.replace(
+                uuid=uuid.UUID(int=i), properties={"i": i}, vector=vector.tolist()
+            )
+            live.set(i, vector)
+        finally:
+            live.release(i)
+    elif op == "delete":
+        i = live.reserve_alive(rng)
+        if i is None:
+            return None
+        try:
+            collection.data.delete_by_id(uuid.UUID(int=i))
+            live.delete(i)
+        finally:
+            live.release(i)
+    return {}
+
+
+def run_mixed(
+    client,
+    dataset,
+    distance,
+    ratios,
+    duration=120,
+    workers=8,
+    ef=64,
+    limit=10,
+    probe_interval=15,
+    probe_queries=200,
+    window=10,
+    seed=0,
+):
+    """Runs queries and writes concurrently in the given ratios on the live index.
+
+    Every worker thread picks its next operation at random by `ratios`. Every
+    `probe_interval` seconds a fixed sample of test queries is checked against an exact
+    ground truth of the mutations acknowledged so far, which shows recall drift. Returns the
+    per-window time series and a summary.
+    """
+    collection = client.collections.get(class_name)
+    set_ef(client, collection, ef)
+    queries = dataset["test"][:]
+    live = LiveIndex(dataset["train"], distance)
+    probe = queries[np.random.default_rng(seed).choice(len(queries), probe_queries, replace=False)]
+    ops = list(ratios.keys())
+    weights = list(ratios.values())
+    records = []
+    probes = []
+    stop = threading.Event()
+    start = time.time()
+
+    def worker(n):
+        rng = np.random.default_rng([seed, n])
+        out = []
+        while not stop.is_set():
+            op = ops[rng.choice(len(ops), p=weights)]
+            before = time.time()
+            try:
+                res = _operation(collection, live, queries, op, rng, limit)
+                if res is not None:
+                    out.append((time.time() - start, op, time.time() - before, True))
+            except Exception as e:
+                logger.debug(f"mixed workload {op} failed: {e}")
+                out.append((time.time() - start, op, time.time() - before, False))
+        return out
+
+    def prober():
+        while not stop.wait(probe_interval):
+            snapshot = live.snapshot()
+            t = time.time() - start
+            res = [search_grpc(collection, q.tolist(), limit=limit) for q in probe]
+            neighbors = live.neighbors(probe, limit, snapshot)
+            ids = result_ids([r["ids"] for r in res], limit)
+            recall = float(recall_at_k(ids, neighbors, limit).mean())
+            logger.info(f"mixed workload: t={t:.0f}s recall={recall:.4f}")
+            probes.append({"t": t, "recall": recall})
+
+    probe_thread = threading.Thread(target=prober, daemon=True)
+    probe_thread.start()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(worker, n) for n in range(workers)]
+        time.sleep(duration)
+        stop.set()
+        for future in futures:
+            records += future.result()
+    probe_thread.join()
+    elapsed = time.time() - start
+
+    return windows(records, probes, window, start), summary(records, probes, elapsed)
+
+
+def windows(records, probes, window, start=0):
+    """Aggregates operation records into a time series of `window` second buckets."""
+    out = []
+    for w, rows in enumerate(bucket(records, window)):
+        sample = {
+            "t": start + w * window,
+            "elapsed_s": w * window,
+            "phase": "mixed",
+            **latency_summary([r[2] for r in rows if r[1] == "query" and r[3]]),
+            "errors": sum(1 for r in rows if not r[3]),
+        }
+        for op in OPERATIONS:
+            sample[f"{op}_per_second"] = sum(1 for r in rows if r[1] == op and r[3]) / window
+        in_window = [p["recall"] for p in probes if w * window <= p["t"] < (w + 1) * window]
+        if in_window:
+            sample["recall"] = float(np.mean(in_window))
+        out.append(sample)
+    return out
+
+
+def summary(records, probes, elapsed):
+    latencies = [r[2] for r in records if r[1] == "query" and r[3]]
+    out = {
+        **latency_summary(latencies),
+        "duration_s": elapsed,
+        "errors": sum(1 for r in records if not r[3]),
+    }
+    for op in OPERATIONS:
+        out[f"{op}_per_second"] = sum(1 for r in records if r[1] == op and r[3]) / elapsed
+    out["qps"] = out["query_per_second"]
+    if probes:
+        out["recall"] = float(np.mean([p["recall"] for p in probes]))
+        out["recall_first"] = probes[0]["recall"]
+        out["recall_last"] = probes[-1]["recall"]
+    return out
+
+
+def store(run_id, samples, row, path="./results"):
+    store_run(run_id, "mixed", [row], {"mixed_samples": samples}, path)
@@ -0,0 +1,223 @@
+import asyncio
+import contextlib
+import time
+import numpy as np
+import weaviate
+from loguru import logger
+
+from cluster import BalancedCollection
+from latency import latency_summary
+from recall import result_ids, recall_summary
+
+ARRIVALS = ["poisson", "constant"]
+# the automatic sweep multiplies the offered load by this factor per step
+RATE_STEP = 1.5
+# a step is saturated when less than this fraction of the offered load was achieved
+SATURATION = 0.9
+
+
+def arrival_offsets(rate, count, arrivals="poisson", seed=0):
+    """Intended send times (seconds from the start) of `count` queries at `rate` per second."""
+    if arrivals == "poisson":
+        # a Poisson process conditioned on `count` arrivals: uniform times over the window,
+        # so every step offers exactly the requested average rate
+        return np.sort(np.random.default_rng(seed).uniform(0, count / rate, count))
+    if arrivals == "constant":
+        return np.arange(count) / rate
+    raise ValueError(f"unknown arrivals {arrivals}, must be one of {ARRIVALS}")
+
+
+async def _search(collection, vec, limit, multivector):
+    if not multivector:
+        res = await collection.query.near_vector(
+            near_vector=vec.tolist(), limit=limit, return_properties=[]
+        )
+    else:
+        res = await collection.query.near_vector(
+            near_vector=vec.tolist(),
+            limit=limit,
+            target_vector="multivector",
+            return_properties=[],
+        )
+    return [obj.uuid.int for obj in res.objects]
+
+
+async def _open_loop(collection, vectors, offsets, limit, multivector):
+    """Sends query i at offsets[i] regardless of how many are still in flight.
+
+    Latency is taken from the intended send time, so queueing delay (on the client or
+    the server) is included instead of hidden by waiting for the previous response.
+    """
+    latencies = np.full(len(offsets), np.nan)
+    ids = [[] for _ in offsets]
+    errors = 0
+
+    async def one(i, intended):
+        nonlocal errors
+        try:
+            ids[i] = await _search(collection, vectors[i % len(vectors)], limit, multivector)
+        except Exception as e:
+            errors += 1
+            logger.debug(f"open loop query failed: {e}")
+        latencies[i] = time.perf_counter() - intended
+
+    start = time.perf_counter()
+    tasks = []
+    for i, offset in enumerate(offsets):
+        intended = start + offset
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i, intended)))
+    await asyncio.gather(*tasks)
+    return latencies, ids, errors, time.perf_counter() - start
+
+
+async def measure_open_loop(
+    collection, vectors, neighbors, rate, duration, limit, k, multivector, arrivals="poisson"
+):
+    """Offers `rate` queries per second for `duration` seconds, cycling through the test set."""
+    count = max(1, int(rate * duration))
+    offsets = arrival_offsets(rate, count, arrivals)
+    latencies, ids, errors, elapsed = await _open_loop(
+        collection, vectors, offsets, limit, multivector
+    )
+    rows = np.arange(count) % len(vectors)
+    recalls = recall_summary(result_ids(ids, limit), neighbors[rows], k)
+    return {
+        "arrivals": arrivals,
+        "offered_qps": rate,
+        **latency_summary(latencies),
+        "qps": (count - errors) / elapsed,
+        "errors": errors,
+        "limit": limit,
+        "k": k,
+        **recalls,
+    }
+
+
+async def _sweep(
+    vectors,
+    neighbors,
+    rates,
+    duration,
+    limit,
+    k,
+    multivector,
+    arrivals,
+    class_name,
+    start_rate,
+    max_steps,
+    nodes,
+):
+    async with contextlib.AsyncExitStack() as stack:
+        if nodes:
+            clients = [
+                await stack.enter_async_context(
+                    weaviate.use_async_with_local(
+                        host=node.host, port=node.http_port, grpc_port=node.grpc_port
+                    )
+                )
+                for node in nodes
+            ]
+        else:
+            clients = [await stack.enter_async_context(weaviate.use_async_with_local())]
+        collection = BalancedCollection([c.collections.get(class_name) for c in clients])
+        points = []
+        rate = start_rate
+        for step in range(len(rates) if rates else max_steps):
+            if rates:
+                rate = rates[step]
+            point = await measure_open_loop(
+                collection, vectors, neighbors, rate, duration, limit, k, multivector, arrivals
+            )
+            logger.info(
+                f"open loop: offered={rate:.0f}/s, achieved={point['qps']:.0f}/s, p50={point['p50']}, p99={point['p99']}, errors={point['errors']}"
+            )
+            points.append(point)
+            if not rates:
+                if point["qps"] < SATURATION * rate:
+                    logger.info(f"open loop: saturated at offered={rate:.0f}/s")
+                    break
+                rate *= RATE_STEP
+        return points
+
+
+def sweep(
+    vectors,
+    neighbors,
+    rates=None,
+    duration=30,
+    limit=10,
+    k=10,
+    multivector=False,
+    arrivals="poisson",
+    class_name="Vector",
+    start_rate=50,
+    max_steps=20,
+    nodes=None,
+):
+    """Measures one point of the latency/throughput curve per offered rate.
+
+    Without explicit `rates` the load starts at `start_rate` and grows by RATE_STEP until
+    the achieved throughput falls behind the offered load (saturation). Note that a single
+    Python event loop itself tops out at a few thousand queries per second.
+    With `nodes` (see cluster.parse_nodes) there is one async client per node and the queries
+    are sent to them round-robin.
+    """
+    return asyncio.run(
+        _sweep(
+            vectors,
+            neighbors,
+            rates,
+            duration,
+            limit,
+            k,
+            multivector,
+            arrivals,
+            class_name,
+            start_rate,
+            max_steps,
+            nodes,
+        )
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    from results_store import load_results
+
+    parser = argparse.ArgumentParser(description="plot latency vs throughput of open-loop runs")
+    parser.add_argument("--results-dir", default="./results")
+    parser.add_argument("--run-id")
+    parser.add_argument("--output", default="open_loop.png")
+    args = parser.parse_args()
+
+    where, params = "offered_qps IS NOT NULL", ()
+    if args.run_id is not None:
+        where, params = where + " AND run_id = ?", (args.run_id,)
+    df = load_results(args.results_dir, where, params)
+    df = df.melt(
+        id_vars=["ef", "qps", "offered_qps"],
+        value_vars=["p50", "p99"],
+        var_name="percentile",
+        value_name="latency",
+    )
+
+    sns.set_theme()
+    sns.relplot(
+        height=7,
+        aspect=1.2,
+        data=df,
+        kind="line",
+        markers=True,
+        x="qps",
+        y="latency",
+        hue="ef",
+        style="percentile",
+    )
+    plt.yscale("log")
+    plt.savefig(args.output)
@@ -0,0 +1,126 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+RECALL_TARGETS = [0.90, 0.95, 0.99]
+# rows of one configuration differ only in ef and these measured values
+MEASURED = [
+    "ef",
+    "qps",
+    "recall",
+    "mean",
+    "p50",
+    "p90",
+    "p99",
+    "p999",
+    "max",
+    "heap_mb",
+    "batch_speedup",
+    "latency_per_token",
+]
+# per-ef breakdowns of the latency, e.g. server_mean or encode_p99
+MEASURED_SUFFIXES = ("_mean", "_p99")
+# columns that identify a configuration within a run, where present
+CONFIG_KEYS = [
+    "run_id",
+    "api",
+    "concurrency",
+    "batch_size",
+    "selectivity",
+    "efConstruction",
+    "maxConnections",
+    "shards",
+    "quantization",
+    "after_restart",
+]
+
+
+def pareto_frontier(recall, qps, ef=None):
+    """Returns the points no other point beats in both recall and QPS, by ascending recall."""
+    recall, qps = np.asarray(recall, dtype=np.float64), np.asarray(qps, dtype=np.float64)
+    ef = np.asarray(ef) if ef is not None else np.full(len(recall), -1)
+    order = np.lexsort((-qps, -recall))
+    frontier = []
+    best_qps = -np.inf
+    for i in order:
+        if qps[i] > best_qps:
+            frontier.append((float(recall[i]), float(qps[i]), int(ef[i])))
+            best_qps = qps[i]
+    return frontier[::-1]
+
+
+def qps_at_recall(recall, qps, target):
+    """Interpolates the QPS at `target` recall along the Pareto frontier of the points.
+
+    Returns NaN if no point reaches the target.
+    """
+    frontier = pareto_frontier(recall, qps)
+    if len(frontier) == 0 or frontier[-1][0] < target:
+        return float("nan")
+    recalls = np.array([p[0] for p in frontier])
+    qpss = np.array([p[1] for p in frontier])
+    if recalls[0] >= target:
+        return float(qpss[0])
+    return float(np.interp(target, recalls, qpss))
+
+
+def min_ef_for_recall(recall, ef, target):
+    """Returns the smallest ef that reached `target` recall, or NaN."""
+    reached = [e for r, e in zip(recall, ef) if r >= target]
+    return min(reached) if reached else float("nan")
+
+
+def tradeoffs(df, targets=RECALL_TARGETS):
+    """Computes the recall/QPS frontier of every configuration in `df`.
+
+    Returns one row per configuration and recall target with the interpolated QPS and the
+    minimal ef reaching the target. All other columns of the configuration (labels) are kept.
+    """
+    if len(df) == 0 or any(c not in df for c in ["ef", "recall", "qps"]):
+        return pd.DataFrame()
+    if "offered_qps" in df:
+        # open-loop rows are points of a latency/throughput curve, not of the recall tradeoff
+        df = df[df["offered_qps"].isna()]
+    if "workload" in df:
+        df = df[df["workload"].isna()]
+    keys = [c for c in CONFIG_KEYS if c in df]
+    rows = []
+    for _, config in df.groupby(keys, dropna=False, sort=False):
+        config = config.dropna(subset=["recall", "qps"])
+        if len(config) == 0:
+            continue
+        base = {
+            k: v
+            for k, v in config.iloc[0].items()
+            if k not in MEASURED
+            and not k.startswith("recall")
+            and not k.endswith(MEASURED_SUFFIXES)
+        }
+        frontier = pareto_frontier(config["recall"], config["qps"], config["ef"])
+        for target in targets:
+            rows.append(
+                {
+                    **base,
+                    "target_recall": target,
+                    "qps_at_recall": qps_at_recall(config["recall"], config["qps"], target),
+                    "min_ef": min_ef_for_recall(config["recall"], config["ef"], target),
+                    "max_recall": float(config["recall"].max()),
+                    "frontier": [list(p) for p in frontier],
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    from results_store import ResultsStore
+
+    parser = argparse.ArgumentParser(description="print QPS at standard recall targets")
+    parser.add_argument("--results-dir", default="./results")
+    args = parser.parse_args()
+
+    with ResultsStore(f"{args.results_dir}/results.sqlite") as store:
+        store.sync(args.results_dir)
+        df = store.tradeoffs()
+    columns = CONFIG_KEYS + ["dataset_file", "target_recall", "qps_at_recall", "min_ef"]
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(df[[c for c in columns if c in df]])
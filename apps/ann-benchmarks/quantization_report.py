@@ -0,0 +1,100 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from pareto import qps_at_recall
+from regression import baseline_rows
+from results_store import load_results
+
+MB = 1024 * 1024
+REPORTS_DIR = "./results/reports"
+UNCOMPRESSED = ["none", "false", "False"]
+COLUMNS = [
+    "quantization",
+    "heap_bytes_per_vector",
+    "import_seconds",
+    "ef",
+    "recall",
+    "recall_loss",
+    "qps",
+    "p99",
+    "qps_at_recall_0.95",
+]
+
+
+def at_ef(rows, ef):
+    """The row measured at `ef`, or at the closest ef that was measured."""
+    return rows.iloc[(rows["ef"] - ef).abs().argsort().iloc[0]]
+
+
+def compare_quantizations(df, ef=64):
+    """Builds one row per quantization of a comparison run.
+
+    Heap per vector is the median in-use heap across the query steps divided by the number
+    of imported objects. Import time includes the pause to enable quantization. Recall and
+    QPS are taken at `ef` (or the closest measured ef), the recall loss is relative to the
+    uncompressed run if it is part of the comparison.
+    """
+    if "quantization" not in df:
+        return pd.DataFrame(columns=COLUMNS)
+    df = baseline_rows(df)
+    if "offered_qps" in df:
+        df = df[df["offered_qps"].isna()]
+
+    rows = []
+    for quantization, group in df.groupby("quantization", sort=False):
+        point = at_ef(group, ef)
+        heap_mb = group["heap_mb"][group["heap_mb"] > 0].median()
+        objects = group["import_objects"].max() if "import_objects" in group else np.nan
+        rows.append(
+            {
+                "quantization": quantization,
+                "heap_bytes_per_vector": heap_mb * MB / objects if objects else np.nan,
+                "import_seconds": (
+                    group["import_seconds"].max() if "import_seconds" in group else np.nan
+                ),
+                "ef": point["ef"],
+                "recall": point["recall"],
+                "qps": point["qps"],
+                "p99": point["p99"],
+                "qps_at_recall_0.95": qps_at_recall(group["recall"], group["qps"], 0.95),
+            }
+        )
+    report = pd.DataFrame(rows)
+    uncompressed = report[report["quantization"].isin(UNCOMPRESSED)]
+    baseline = uncompressed["recall"].iloc[0] if len(uncompressed) else np.nan
+    report["recall_loss"] = baseline - report["recall"]
+    return report[COLUMNS]
+
+
+def print_report(report):
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(report.to_string(index=False))
+
+
+def store_report(report, comparison_id, path=REPORTS_DIR):
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, f"quantization_{comparison_id}.csv")
+    logger.info(f"storing quantization comparison in {filename}")
+    report.to_csv(filename, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare the quantizations of a comparison run")
+    parser.add_argument("--results-dir", default="./results")
+    parser.add_argument("--comparison-id", help="defaults to the latest comparison")
+    parser.add_argument("--ef", type=int, default=64)
+    args = parser.parse_args()
+
+    df = load_results(args.results_dir)
+    if "comparison_id" not in df or df["comparison_id"].isna().all():
+        logger.error("no comparison runs found, run run.py with --compare-quantizations")
+        raise SystemExit(1)
+    df = df[df["comparison_id"].notna()]
+    comparison_id = args.comparison_id or df["comparison_id"].astype(int).max()
+    report = compare_quantizations(
+        df[df["comparison_id"].astype(str) == str(comparison_id)], args.ef
+    )
+    print_report(report)
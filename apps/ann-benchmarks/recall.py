@@ -0,0 +1,45 @@
+import numpy as np
+
+RECALL_AT = [1, 10, 100]
+
+
+def result_ids(id_lists, limit):
+    """Packs the returned ids of every query into an (n_queries x limit) array padded with -1."""
+    ids = np.full((len(id_lists), limit), -1, dtype=np.int64)
+    for i, row in enumerate(id_lists):
+        row = row[:limit]
+        ids[i, : len(row)] = row
+    return ids
+
+
+def recall_at_k(ids, neighbors, k, block_size=1024):
+    """Computes recall@k for every query in one vectorized pass over blocks of queries.
+
+    `ids` holds the returned ids (padded with -1) and `neighbors` the ground truth, both
+    ordered by query. Only the first k columns of each are compared. A ground truth padded
+    with -1 (e.g. a filter matching fewer than k objects) only counts its valid entries.
+    """
+    if k > ids.shape[1]:
+        raise ValueError(f"cannot compute recall@{k} from {ids.shape[1]} results per query")
+    if k > neighbors.shape[1]:
+        raise ValueError(f"cannot compute recall@{k} from {neighbors.shape[1]} true neighbors")
+
+    ids = ids[:, :k]
+    neighbors = neighbors[: len(ids), :k]
+    hits = np.empty(len(ids), dtype=np.int64)
+    expected = np.maximum((neighbors >= 0).sum(axis=1), 1)
+    for start in range(0, len(ids), block_size):
+        block_ids = ids[start : start + block_size, :, None]
+        block_neighbors = neighbors[start : start + block_size, None, :]
+        matches = (block_ids == block_neighbors) & (block_ids >= 0)
+        hits[start : start + block_size] = matches.any(axis=2).sum(axis=1)
+    return hits / expected
+
+
+def recall_summary(ids, neighbors, k):
+    """Returns the mean recall@k plus recall@1/@10/@100 where the results allow it."""
+    out = {"recall": float(recall_at_k(ids, neighbors, k).mean())}
+    for at in RECALL_AT:
+        if at <= ids.shape[1] and at <= neighbors.shape[1]:
+            out[f"recall@{at}"] = float(recall_at_k(ids, neighbors, at).mean())
+    return out
@@ -0,0 +1,211 @@
+import argparse
+import json
+import sys
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from results_store import load_results
+from pareto import qps_at_recall
+
+# runs are only compared with prior runs that share all of these (where present)
+GROUP_BY = ["dataset_file", "machine_type", "quantization", "maxConnections", "after_restart"]
+
+
+def baseline_rows(df):
+    """Keeps the rows comparable across runs: single client, unfiltered, default api."""
+    if "api" in df:
+        df = df[df["api"].isna() | (df["api"] == "grpc")]
+    if "concurrency" in df:
+        df = df[df["concurrency"].isna() | (df["concurrency"] == 1)]
+    if "selectivity" in df:
+        df = df[df["selectivity"].isna()]
+    if "workload" in df:
+        df = df[df["workload"].isna()]
+    return df
+
+
+def run_metrics(df, target_recall):
+    """Summarizes every run (per group) into QPS at the target recall and heap usage."""
+    group_by = [c for c in GROUP_BY if c in df]
+    rows = []
+    for keys, run in baseline_rows(df).groupby(group_by + ["run_id"], dropna=False):
+        rows.append(
+            {
+                **dict(zip(group_by + ["run_id"], keys)),
+                "qps_at_recall": qps_at_recall(run["recall"], run["qps"], target_recall),
+                "heap_mb": run["heap_mb"][run["heap_mb"] > 0].median(),
+            }
+        )
+    out = pd.DataFrame(rows)
+    if len(out):
+        out["time"] = out["run_id"].astype("int")
+        out = out.sort_values("time")
+    return out, group_by
+
+
+def bootstrap_ci(values, confidence=0.95, resamples=2000, seed=0):
+    """Bootstrap confidence interval of the mean of `values`."""
+    values = np.asarray(values, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    means = rng.choice(values, size=(resamples, len(values)), replace=True).mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return float(np.quantile(means, alpha)), float(np.quantile(means, 1 - alpha))
+
+
+def check(history, value, higher_is_better, min_effect, confidence=0.95):
+    """Compares one value against the bootstrap CI of the baseline history.
+
+    A regression needs both: the value lies outside the CI on the bad side and it is worse
+    than the baseline mean by more than `min_effect` (relative).
+    """
+    low, high = bootstrap_ci(history, confidence)
+    mean = float(np.mean(history))
+    change = (value - mean) / mean if mean else 0.0
+    if higher_is_better:
+        regression = value < low and change < -min_effect
+    else:
+        regression = value > high and change > min_effect
+    return {
+        "value": value,
+        "baseline_mean": mean,
+        "ci_low": low,
+        "ci_high": high,
+        "change": change,
+        "baseline_runs": len(history),
+        "passed": not regression,
+    }
+
+
+def analyze(
+    df,
+    run_id=None,
+    target_recall=0.95,
+    window=10,
+    min_baseline=3,
+    min_effect=0.03,
+    confidence=0.95,
+    reference_since=None,
+    reference_runs=10,
+):
+    """Checks a run against the prior runs with the same labels.
+
+    Defaults to the latest run. Every metric is compared with a rolling baseline of the
+    last `window` prior runs. With `reference_since` (a run id) it is also compared with a
+    reference of the first `reference_runs` runs from that run on, so gradual drift that the
+    rolling baseline follows still fails; after an accepted change the reference is moved
+    by passing a later run id. Returns one report entry per group, metric and baseline.
+    """
+    metrics, group_by = run_metrics(df, target_recall)
+    if len(metrics) == 0:
+        return []
+    if run_id is None:
+        run_id = metrics["run_id"].iloc[-1]
+    run_id = str(run_id)
+
+    report = []
+    for keys, group in metrics.groupby(group_by, dropna=False):
+        current = group[group["run_id"].astype(str) == run_id]
+        if len(current) == 0:
+            continue
+        current = current.iloc[-1]
+        prior = group[group["time"] < current["time"]]
+        baselines = [("rolling", prior.tail(window))]
+        if reference_since is not None:
+            reference = prior[prior["time"] >= int(reference_since)].head(reference_runs)
+            baselines.append(("reference", reference))
+
+        for metric, higher_is_better in [("qps_at_recall", True), ("heap_mb", False)]:
+            for baseline, runs in baselines:
+                entry = {
+                    "run_id": run_id,
+                    **dict(zip(group_by, keys)),
+                    "metric": metric,
+                    "baseline": baseline,
+                    "target_recall": target_recall,
+                }
+                history = runs[metric].dropna()
+                if pd.isna(current[metric]):
+                    report.append({**entry, "passed": True, "note": "no value for this run"})
+                elif len(history) < min_baseline:
+                    report.append(
+                        {
+                            **entry,
+                            "value": float(current[metric]),
+                            "baseline_runs": len(history),
+                            "passed": True,
+                            "note": "not enough baseline runs",
+                        }
+                    )
+                else:
+                    report.append(
+                        {
+                            **entry,
+                            **check(
+                                history,
+                                float(current[metric]),
+                                higher_is_better,
+                                min_effect,
+                                confidence,
+                            ),
+                        }
+                    )
+    return report
+
+
+def print_report(report):
+    for entry in report:
+        status = "PASS" if entry["passed"] else "FAIL"
+        labels = ", ".join(
+            f"{k}={entry[k]}" for k in GROUP_BY if k in entry and not pd.isna(entry[k])
+        )
+        if "baseline_mean" in entry:
+            logger.info(
+                f"{status} {entry['metric']} [{labels}]: {entry['value']:.2f} vs {entry['baseline']} baseline "
+                f"{entry['baseline_mean']:.2f} (CI {entry['ci_low']:.2f}-{entry['ci_high']:.2f}, "
+                f"{entry['change']:+.1%}, {entry['baseline_runs']} runs)"
+            )
+        else:
+            logger.info(
+                f"{status} {entry['metric']} ({entry['baseline']}) [{labels}]: {entry.get('note')}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compare a run against the history of runs with the same labels"
+    )
+    parser.add_argument("--results-dir", default="./results")
+    parser.add_argument("--run-id")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument(
+        "--reference-since", help="run id from which on runs serve as long-term reference"
+    )
+    parser.add_argument(
+        "--reference-runs", type=int, default=10, help="runs in the long-term reference"
+    )
+    parser.add_argument("--min-baseline", type=int, default=3)
+    parser.add_argument("--min-effect", type=float, default=0.03)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--output", default="regression_report.json")
+    args = parser.parse_args()
+
+    report = analyze(
+        load_results(args.results_dir),
+        args.run_id,
+        args.target_recall,
+        args.window,
+        args.min_baseline,
+        args.min_effect,
+        args.confidence,
+        args.reference_since,
+        args.reference_runs,
+    )
+    print_report(report)
+    with open(args.output, "w") as f:
+        f.write(json.dumps(report, default=str))
+
+    if not all(entry["passed"] for entry in report):
+        logger.error("regression detected")
+        sys.exit(1)
@@ -0,0 +1,263 @@
+import glob
+import json
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from pareto import tradeoffs
+
+RESULTS_DIR = "./results"
+DEFAULT_PATH = os.path.join(RESULTS_DIR, "results.sqlite")
+
+# every table also grows a column for each new key it is given (labels, mode specific metrics)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    source TEXT NOT NULL,
+    run_id TEXT,
+    api TEXT,
+    ef INTEGER,
+    efConstruction INTEGER,
+    maxConnections INTEGER,
+    shards INTEGER,
+    concurrency INTEGER,
+    mean REAL,
+    p50 REAL,
+    p90 REAL,
+    p99 REAL,
+    p999 REAL,
+    max REAL,
+    qps REAL,
+    recall REAL,
+    heap_mb REAL
+);
+CREATE INDEX IF NOT EXISTS results_source ON results (source);
+CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id);
+CREATE TABLE IF NOT EXISTS samples (
+    source TEXT NOT NULL,
+    run_id TEXT,
+    kind TEXT,
+    phase TEXT,
+    t REAL
+);
+CREATE INDEX IF NOT EXISTS samples_source ON samples (source);
+CREATE INDEX IF NOT EXISTS samples_run_id ON samples (run_id, kind);
+CREATE TABLE IF NOT EXISTS tradeoffs (
+    source TEXT NOT NULL,
+    run_id TEXT,
+    target_recall REAL,
+    qps_at_recall REAL,
+    min_ef INTEGER,
+    max_recall REAL
+);
+CREATE INDEX IF NOT EXISTS tradeoffs_source ON tradeoffs (source);
+"""
+
+# keys of the per-run profile files that are stored as samples of the given kind
+SAMPLE_KINDS = {
+    "heap_samples": "heap",
+    "cpu_profiles": "cpu",
+    "import_samples": "import",
+    "mixed_samples": "mixed",
+    "node_samples": "node",
+    "shard_samples": "shard",
+    "token_samples": "tokens",
+    "coldstart_samples": "coldstart",
+}
+# subdirectories of the results directory holding per-run sample files, and the result rows
+# of workloads (e.g. mixed) that the static query results in the top level shouldn't mix with
+SAMPLE_DIRS = ["profiles", "imports", "mixed", "delete", "cluster", "multivector", "coldstart"]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _value(v):
+    if isinstance(v, (list, dict)):
+        return json.dumps(v)
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
+
+class ResultsStore:
+    """Append-only SQLite store for benchmark results and resource samples.
+
+    The per-run JSON files written to the results directory stay the source of truth.
+    `sync` ingests files that are new or changed since the last sync and drops rows of
+    files that were deleted, so analysis only ever parses new files.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self._columns = {}
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def columns(self, table):
+        if table not in self._columns:
+            self._columns[table] = {
+                row[1] for row in self.conn.execute(f"PRAGMA table_info({_quote(table)})")
+            }
+        return self._columns[table]
+
+    def _ensure_columns(self, table, keys):
+        for key in keys:
+            if key not in self.columns(table):
+                self.conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(key)}")
+                self._columns[table].add(key)
+
+    def append(self, table, source, rows):
+        for row in rows:
+            row = {"source": source, **{k: _value(v) for k, v in row.items()}}
+            self._ensure_columns(table, row.keys())
+            self.conn.execute(
+                f"INSERT INTO {_quote(table)} ({', '.join(_quote(k) for k in row)}) "
+                f"VALUES ({', '.join('?' for _ in row)})",
+                list(row.values()),
+            )
+
+    def _delete_source(self, source):
+        for table in ["results", "samples", "tradeoffs"]:
+            self.conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+        self.conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    def ingest_file(self, filename, results_dir=RESULTS_DIR):
+        """(Re-)ingests one result or profile file, replacing rows it contributed before."""
+        source = os.path.relpath(filename, results_dir)
+        stat = os.stat(filename)
+        with open(filename, "r") as f:
+            parsed = json.loads(f.read())
+
+        with self.conn:
+            self._delete_source(source)
+            if isinstance(parsed, list):
+                self.append("results", source, parsed)
+                # recall/QPS tradeoffs are derived once per file and stored as metrics
+                self.append("tradeoffs", source, tradeoffs(pd.DataFrame(parsed)).to_dict("records"))
+            else:
+                for key, kind in SAMPLE_KINDS.items():
+                    self.append(
+                        "samples",
+                        source,
+                        [
+                            {"run_id": parsed.get("run_id"), "kind": kind, **s}
+                            for s in parsed.get(key, [])
+                        ],
+                    )
+            self.conn.execute(
+                "INSERT INTO sources (source, mtime, size) VALUES (?, ?, ?)",
+                (source, stat.st_mtime, stat.st_size),
+            )
+
+    def sync(self, results_dir=RESULTS_DIR):
+        """Ingests new or changed result files and forgets the ones that were removed."""
+        known = {
+            source: (mtime, size)
+            for source, mtime, size in self.conn.execute("SELECT source, mtime, size FROM sources")
+        }
+        present = set()
+        filenames = glob.glob(os.path.join(results_dir, "*.json"))
+        for subdir in SAMPLE_DIRS:
+            filenames += glob.glob(os.path.join(results_dir, subdir, "*.json"))
+        ingested = 0
+        for filename in filenames:
+            source = os.path.relpath(filename, results_dir)
+            present.add(source)
+            stat = os.stat(filename)
+            if known.get(source) != (stat.st_mtime, stat.st_size):
+                self.ingest_file(filename, results_dir)
+                ingested += 1
+
+        removed = set(known) - present
+        with self.conn:
+            for source in removed:
+                self._delete_source(source)
+        if ingested or removed:
+            logger.info(f"results store: ingested {ingested} files, removed {len(removed)}")
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+    def results(self, where=None, params=(), columns=None):
+        """Loads result rows as a DataFrame, optionally only some columns and rows.
+
+        Requested columns that no result has (yet) are returned as NULL. Selecting them by
+        name would make SQLite fall back to the quoted name as a string literal.
+        """
+        if columns is None:
+            cols = "*"
+        else:
+            known = self.columns("results")
+            cols = ", ".join(_quote(c) if c in known else f"NULL AS {_quote(c)}" for c in columns)
+        sql = f"SELECT {cols} FROM results"
+        if where is not None:
+            sql += f" WHERE {where}"
+        return self.query(sql, params)
+
+    def tradeoffs(self, where=None, params=()):
+        """Loads QPS at standard recall targets and minimal ef per configuration."""
+        sql = "SELECT * FROM tradeoffs"
+        if where is not None:
+            sql += f" WHERE {where}"
+        return self.query(sql, params)
+
+    def samples(self, kind=None, run_id=None):
+        """Loads resource samples, optionally of one kind and/or run."""
+        sql, params = "SELECT * FROM samples WHERE 1 = 1", []
+        if kind is not None:
+            sql += " AND kind = ?"
+            params.append(kind)
+        if run_id is not None:
+            sql += " AND run_id = ?"
+            params.append(run_id)
+        return self.query(sql + " ORDER BY t", params)
+
+
+def store_run(run_id, kind=None, rows=None, samples=None, path=RESULTS_DIR):
+    """Writes the files of one run and ingests them into the store in `path`.
+
+    `rows` are stored as result rows in <kind>/<run_id>-<kind>.json, `samples` (lists by
+    SAMPLE_KINDS key) in <kind>/<run_id>.json. Without `kind` the rows are the static query
+    results and go to <run_id>.json in `path` itself.
+    """
+    directory = os.path.join(path, kind) if kind else path
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    if samples is not None:
+        filenames.append(os.path.join(directory, f"{run_id}.json"))
+        with open(filenames[-1], "w") as f:
+            f.write(json.dumps({"run_id": run_id, **samples}))
+    if rows is not None:
+        filenames.append(
+            os.path.join(directory, f"{run_id}-{kind}.json" if kind else f"{run_id}.json")
+        )
+        with open(filenames[-1], "w") as f:
+            f.write(json.dumps(rows))
+    logger.info(f"storing {kind or 'query'} results of run {run_id} in {', '.join(filenames)}")
+    with ResultsStore(os.path.join(path, "results.sqlite")) as store:
+        for filename in filenames:
+            store.ingest_file(filename, path)
+
+
+def load_results(results_dir=RESULTS_DIR, where=None, params=(), columns=None):
+    """Syncs the store in `results_dir` and returns its results as a DataFrame."""
+    with ResultsStore(os.path.join(results_dir, "results.sqlite")) as store:
+        store.sync(results_dir)
+        return store.results(where, params, columns)
@@ -3,15 +3,38 @@ import weaviate
 import sys
 from loguru import logger
 import h5py
-import torch
 import grpc
 import pathlib
 import time
 import os
 from datetime import timedelta
 
-from weaviate_import import reset_schema, load_records, wait_for_all_shards_ready
-from weaviate_query import query
+from weaviate_import import (
+    MULTIVECTOR_DIM,
+    QUANTIZATION_PAUSE,
+    reset_schema,
+    load_records,
+    load_records_parallel,
+    wait_for_all_shards_ready,
+)
+from weaviate_query import APIS, query, class_name
+from weaviate_grpc import SearchStub
+from open_loop import ARRIVALS
+from index_cache import index_key, restore as restore_index, store as store_index
+from weaviate_pprof import Profiler
+from quantization_report import compare_quantizations, print_report, store_report
+from results_store import load_results
+from mixed_workload import parse_ratios, run_mixed, store as store_mixed
+from import_monitor import ImportMonitor, WEAVIATE_ORIGIN
+from dataset_reader import multivector_dim
+from cluster import (
+    connect,
+    parse_nodes,
+    snapshot,
+    summary as cluster_summary,
+    store as store_cluster,
+)
+from tombstones import run_delete_benchmark, store as store_delete
 
 values = {
     "m": [16, 24, 32, 48],
@@ -32,20 +55,45 @@ values = {
     "dim_to_segment_ratio": 4,
     "override": False,
     "multivector": False,
+    "multivector_dim": None,
     "rq_bits": 8,
+    "concurrency": [1],
+    "limit": 10,
+    "k": None,
+    "import_workers": 1,
+    "selectivities": [None],
+    "profile_interval": 10,
+    "cpu_profile_seconds": 0,
+    "target_recalls": None,
+    "adaptive_sample": 1000,
+    "apis": ["grpc"],
+    "open_loop_rates": None,
+    "open_loop_duration": 30,
+    "arrivals": "poisson",
+    "index_cache": False,
+    "import_sample_interval": 5,
+    "compare_quantizations": None,
+    "compare_ef": 64,
+    "mixed": None,
+    "mixed_duration": 120,
+    "mixed_workers": 8,
+    "mixed_ef": 64,
+    "delete_fraction": None,
+    "delete_ef": 64,
+    "cleanup_timeout": 3600,
+    "nodes": None,
+    "batch_sizes": None,
 }
 
-pathlib.Path("./results").mkdir(parents=True, exist_ok=True)
-
-
 parser = argparse.ArgumentParser()
-client = weaviate.connect_to_local()
-
-stub = None
-
 parser.add_argument("-v", "--vectors")
 parser.add_argument("-d", "--distance")
 parser.add_argument("-m", "--max-connections")
+parser.add_argument("--shards", help="comma separated shard counts to sweep")
+parser.add_argument(
+    "--nodes",
+    help="comma separated host:http_port[:grpc_port[:pprof_port]] of the cluster nodes to query",
+)
 parser.add_argument("-l", "--labels")
 parser.add_argument("-c", "--quantization")
 parser.add_argument("-q", "--query-only", action=argparse.BooleanOptionalAction)
@@ -53,127 +101,447 @@ parser.add_argument("-o", "--override", action=argparse.BooleanOptionalAction)
 parser.add_argument("-s", "--dim-to-segment-ratio")
 parser.add_argument("-mv", "--multivector", action=argparse.BooleanOptionalAction, default=False)
 parser.add_argument("-mi", "--multivector-implementation", default="regular")
+parser.add_argument(
+    "--multivector-dim",
+    type=int,
+    help="token dimension, read from the dataset's dimension attribute by default",
+)
 parser.add_argument("-rq", "--rq-bits", default=8)
-args = parser.parse_args()
-
-
-if (args.vectors) == None:
-    logger.error(f"need -v or --vectors flag to point to dataset")
-    sys.exit(1)
-
-if (args.distance) == None:
-    logger.error(f"need -d or --distance flag to indicate distance metric")
-    sys.exit(1)
-
-if (args.max_connections) != None:
-    values["m"] = [int(x) for x in args.max_connections.split(",")]
-
+parser.add_argument("--concurrency")
+parser.add_argument("--limit", type=int, default=10)
+parser.add_argument("-k", "--recall-k", type=int, help="recall cut-off, at most --limit")
+parser.add_argument("-w", "--import-workers", type=int, default=1)
+parser.add_argument("-fs", "--filter-selectivity")
+parser.add_argument("--profile-interval", type=float, default=10)
+parser.add_argument("--cpu-profile-seconds", type=int, default=0)
+parser.add_argument("--import-sample-interval", type=float, default=5)
+parser.add_argument(
+    "--compare-quantizations",
+    help="comma separated, e.g. none,pq,sq,bq,rq: import and query each, then report side by side",
+)
+parser.add_argument("--compare-ef", type=int, default=64)
+parser.add_argument(
+    "--mixed",
+    help="run a mixed workload after the queries, e.g. query=0.8,insert=0.1,replace=0.05,delete=0.05",
+)
+parser.add_argument("--mixed-duration", type=float, default=120)
+parser.add_argument("--mixed-workers", type=int, default=8)
+parser.add_argument("--mixed-ef", type=int, default=64)
+parser.add_argument(
+    "--delete-fraction",
+    type=float,
+    help="delete this fraction of the train set after the queries and follow tombstone cleanup",
+)
+parser.add_argument("--delete-ef", type=int, default=64)
+parser.add_argument("--cleanup-timeout", type=float, default=3600)
+parser.add_argument("-tr", "--target-recall")
+parser.add_argument("--adaptive-sample", type=int, default=1000)
+parser.add_argument(
+    "--api",
+    help=f"comma separated, any of {','.join(APIS)} (see --open-loop and --batch-size for the "
+    "async and pipelined modes)",
+)
+parser.add_argument(
+    "--open-loop", help="comma separated offered qps, or auto to sweep to saturation"
+)
+parser.add_argument(
+    "--batch-size",
+    help="comma separated numbers of queries pipelined per round trip over one channel",
+)
+parser.add_argument("--open-loop-duration", type=float, default=30)
+parser.add_argument("--arrivals", choices=ARRIVALS, default="poisson")
+parser.add_argument(
+    "--index-cache",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="restore indexes from filesystem backups instead of re-importing, back up new ones",
+)
 
-labels = {}
-if (args.labels) != None:
-    pairs = [l for l in args.labels.split(",")]
-    for pair in pairs:
-        kv = pair.split("=")
-        if len(kv) != 2:
-            logger.error(f"invalid labels, must be in format key_1=value_2,key_2=value_2")
-        labels[kv[0]] = kv[1]
-    values["labels"] = labels
 
-values["quantization"] = args.quantization or False
-values["override"] = args.override or False
-values["query_only"] = args.query_only
-values["rq_bits"] = int(args.rq_bits)
-if (args.dim_to_segment_ratio) != None:
-    values["dim_to_segment_ratio"] = int(args.dim_to_segment_ratio)
-    values["labels"]["dim_to_segment_ratio"] = values["dim_to_segment_ratio"]
+def benchmark(client, stub, f, args, shards, m, quantization, labels):
+    """Imports (or restores) one index configuration and runs all queries against it.
 
+    Returns the run id the results are stored under.
+    """
+    # read lazily in chunk-aligned blocks by the importer instead of loading it up front
+    vectors = f["train"]
+    efC = values["efC"]
+    distance = args.distance
 
-values["multivector"] = args.multivector
-values["multivector_implementation"] = args.multivector_implementation
-
-# Add better error handling for file opening
-try:
-    # Check if file exists
-    if not os.path.exists(args.vectors):
-        logger.error(f"Dataset file does not exist: {args.vectors}")
-        sys.exit(1)
-
-    # Check if file is empty
-    if os.path.getsize(args.vectors) == 0:
-        logger.error(f"Dataset file is empty: {args.vectors}")
-        sys.exit(1)
-
-    logger.info(
-        f"Opening dataset file: {args.vectors} (size: {os.path.getsize(args.vectors)} bytes)"
+    import_stats = {}
+    monitor = None
+    nodes = values["nodes"]
+    origin = nodes[0].origin if nodes else WEAVIATE_ORIGIN
+    profiler = Profiler(
+        interval=values["profile_interval"],
+        cpu_seconds=values["cpu_profile_seconds"],
+        origins=[node.pprof_origin for node in nodes] if nodes else None,
     )
-    f = h5py.File(args.vectors)
-    logger.info(f"Successfully opened dataset file")
-except OSError as e:
-    logger.error(f"Failed to open dataset file: {args.vectors}")
-    logger.error(f"Error details: {str(e)}")
-    logger.error(f"File exists: {os.path.exists(args.vectors)}")
-    logger.error(
-        f"File size: {os.path.getsize(args.vectors) if os.path.exists(args.vectors) else 'N/A'}"
-    )
-    logger.error(
-        f"File permissions: {oct(os.stat(args.vectors).st_mode)[-3:] if os.path.exists(args.vectors) else 'N/A'}"
-    )
-    sys.exit(1)
-
-
-values["labels"]["dataset_file"] = os.path.basename(args.vectors)
-vectors = f["train"]
-if values["multivector"]:
-    vector_dim: int = 128
-    vectors = [torch.from_numpy(sample.reshape(-1, vector_dim)) for sample in vectors]
-
-
-efC = values["efC"]
-distance = args.distance
-
-print(values["labels"])
-for shards in values["shards"]:
-    for m in values["m"]:
-        if not values["query_only"]:
-            quantization = values["quantization"]
-            override = values["override"]
-            dim_to_seg_ratio = values["dim_to_segment_ratio"]
-            multivector = values["multivector"]
-            multivector_implementation = values["multivector_implementation"]
-            rq_bits = values["rq_bits"]
+    profiler.start("query" if values["query_only"] else "import")
+    if not values["query_only"]:
+        override = values["override"]
+        dim_to_seg_ratio = values["dim_to_segment_ratio"]
+        multivector = values["multivector"]
+        multivector_implementation = values["multivector_implementation"]
+        rq_bits = values["rq_bits"]
+        backup_id = None
+        if values["index_cache"] and override == False:
+            backup_id = index_key(
+                f,
+                efC=efC,
+                m=m,
+                shards=shards,
+                distance=distance,
+                quantization=quantization,
+                dim_to_segment_ratio=dim_to_seg_ratio,
+                multivector=multivector,
+                multivector_implementation=multivector_implementation,
+                multivector_dim=values["multivector_dim"],
+                rq_bits=rq_bits,
+                quantization_pause=QUANTIZATION_PAUSE,
+            )
+            import_stats = restore_index(client, backup_id) or {}
+        if not import_stats.get("index_restored"):
+            monitor = ImportMonitor(origin, interval=values["import_sample_interval"])
+            monitor.start()
             before_import = time.time()
             logger.info(
                 f"Starting import with efC={efC}, m={m}, shards={shards}, distance={distance}"
             )
             if override == False:
                 reset_schema(
-                    client, efC, m, shards, distance, multivector, multivector_implementation
+                    client,
+                    efC,
+                    m,
+                    shards,
+                    distance,
+                    multivector,
+                    multivector_implementation,
+                )
+            if values["import_workers"] > 1:
+                import_stats = load_records_parallel(
+                    client,
+                    args.vectors,
+                    values["import_workers"],
+                    quantization,
+                    dim_to_seg_ratio,
+                    override,
+                    multivector,
+                    multivector_implementation,
+                    rq_bits,
+                    values["multivector_dim"],
+                    nodes,
+                )
+            else:
+                import_stats = load_records(
+                    client,
+                    vectors,
+                    quantization,
+                    dim_to_seg_ratio,
+                    override,
+                    multivector,
+                    multivector_implementation,
+                    rq_bits,
+                    values["multivector_dim"],
                 )
-            load_records(
-                client,
-                vectors,
-                quantization,
-                dim_to_seg_ratio,
-                override,
-                multivector,
-                multivector_implementation,
-                rq_bits,
-            )
             elapsed = time.time() - before_import
+            monitor.stop()
+            import_stats.update(monitor.summary())
+            # includes the pause to enable (and train) quantization
+            import_stats["import_seconds"] = elapsed
+            import_stats["import_objects"] = len(vectors)
+            if "doc_tokens_total" in import_stats:
+                import_stats["import_tokens_per_second"] = (
+                    import_stats["doc_tokens_total"] / elapsed
+                )
+                logger.info(
+                    f"imported {import_stats['doc_tokens_total']} tokens, "
+                    f"{import_stats['doc_tokens_mean']:.1f} per document"
+                )
             logger.info(
                 f"Finished import with efC={efC}, m={m}, shards={shards} in {str(timedelta(seconds=elapsed))}"
             )
             logger.info(f"Waiting 30s for compactions to settle, etc")
             time.sleep(30)
-        logger.info(f"Waiting for all shards to be ready")
-        wait_for_all_shards_ready(client)
-        logger.info(f"Starting querying for efC={efC}, m={m}, shards={shards}")
-        query(
+            if backup_id is not None:
+                import_stats.update(store_index(client, backup_id))
+    logger.info(f"Waiting for all shards to be ready")
+    wait_for_all_shards_ready(client)
+    try:
+        node_samples, shard_samples = snapshot(origin)
+    except Exception as e:
+        logger.warning(f"could not fetch cluster stats: {e}")
+        node_samples, shard_samples = [], []
+    import_stats = {
+        **import_stats,
+        **(cluster_summary(node_samples, shard_samples) if node_samples else {}),
+    }
+    logger.info(f"Starting querying for efC={efC}, m={m}, shards={shards}")
+    profiler.set_phase("query")
+    run_id = query(
+        client,
+        stub,
+        f,
+        values["ef"],
+        labels,
+        values["multivector"],
+        values["concurrency"],
+        values["limit"],
+        values["k"],
+        import_stats,
+        values["selectivities"],
+        profiler,
+        values["target_recalls"],
+        values["adaptive_sample"],
+        values["apis"],
+        values["open_loop_rates"],
+        values["open_loop_duration"],
+        values["arrivals"],
+        nodes,
+        values["batch_sizes"],
+        values["multivector_dim"] or MULTIVECTOR_DIM,
+    )
+    profiler.stop()
+    profiler.store(run_id)
+    if monitor is not None:
+        monitor.store(run_id)
+    store_cluster(run_id, node_samples, shard_samples)
+    if values["mixed"] is not None:
+        # mutates the index, so it runs after the static measurements
+        logger.info(f"Starting mixed workload {values['mixed']}")
+        samples, summary = run_mixed(
             client,
-            stub,
             f,
-            values["ef"],
-            values["labels"],
-            values["multivector"],
+            distance,
+            values["mixed"],
+            values["mixed_duration"],
+            values["mixed_workers"],
+            values["mixed_ef"],
+            values["limit"],
         )
-        logger.info(f"Finished querying for efC={efC}, m={m}, shards={shards}")
+        row = {
+            "api": "grpc",
+            "workload": "mixed",
+            "ef": values["mixed_ef"],
+            "efConstruction": efC,
+            "maxConnections": m,
+            "shards": shards,
+            "concurrency": values["mixed_workers"],
+            **{f"ratio_{op}": ratio for op, ratio in values["mixed"].items()},
+            **summary,
+            "run_id": run_id,
+            **import_stats,
+            **labels,
+        }
+        store_mixed(run_id, samples, row)
+    if values["delete_fraction"] is not None:
+        logger.info(f"Deleting {values['delete_fraction']} of the objects")
+        points, summary = run_delete_benchmark(
+            client,
+            f,
+            distance,
+            values["delete_fraction"],
+            values["delete_ef"],
+            values["limit"],
+            values["k"] or values["limit"],
+            timeout=values["cleanup_timeout"],
+        )
+        rows = [
+            {
+                "api": "grpc",
+                "workload": "delete",
+                "efConstruction": efC,
+                "maxConnections": m,
+                "shards": shards,
+                **point,
+                **summary,
+                "run_id": run_id,
+                **import_stats,
+                **labels,
+            }
+            for point in points
+        ]
+        store_delete(run_id, rows)
+    logger.info(f"Finished querying for efC={efC}, m={m}, shards={shards}")
+    return run_id
+
+
+def main():
+    pathlib.Path("./results").mkdir(parents=True, exist_ok=True)
+
+    args = parser.parse_args()
+    if args.recall_k is not None and args.recall_k > args.limit:
+        parser.error(f"--recall-k {args.recall_k} can't be larger than --limit {args.limit}")
+    unknown = [api for api in (args.api or "grpc").split(",") if api not in APIS]
+    if unknown:
+        parser.error(f"unknown --api {','.join(unknown)}, must be any of {','.join(APIS)}")
+
+    if (args.vectors) == None:
+        logger.error(f"need -v or --vectors flag to point to dataset")
+        sys.exit(1)
+
+    if (args.distance) == None:
+        logger.error(f"need -d or --distance flag to indicate distance metric")
+        sys.exit(1)
+
+    if (args.max_connections) != None:
+        values["m"] = [int(x) for x in args.max_connections.split(",")]
+
+    if (args.shards) != None:
+        values["shards"] = [int(x) for x in args.shards.split(",")]
+
+    if (args.nodes) != None:
+        values["nodes"] = parse_nodes(args.nodes)
+
+    client = connect(values["nodes"][0]) if values["nodes"] else weaviate.connect_to_local()
+
+    if (args.concurrency) != None:
+        values["concurrency"] = [int(x) for x in args.concurrency.split(",")]
+
+    if (args.filter_selectivity) != None:
+        if args.multivector:
+            logger.error(f"--filter-selectivity can't be combined with --multivector")
+            sys.exit(1)
+        values["selectivities"] = [float(x) for x in args.filter_selectivity.split(",")]
+
+    if (args.api) != None:
+        values["apis"] = args.api.split(",")
+
+    if (args.open_loop) != None:
+        values["open_loop_rates"] = (
+            [] if args.open_loop == "auto" else [float(x) for x in args.open_loop.split(",")]
+        )
+
+    if (args.batch_size) != None:
+        values["batch_sizes"] = [int(x) for x in args.batch_size.split(",")]
+
+    if (args.compare_quantizations) != None:
+        values["compare_quantizations"] = args.compare_quantizations.split(",")
+
+    if (args.mixed) != None:
+        if args.multivector:
+            logger.error(f"--mixed can't be combined with --multivector")
+            sys.exit(1)
+        values["mixed"] = parse_ratios(args.mixed)
+
+    if (args.delete_fraction) != None:
+        if args.mixed or args.multivector:
+            logger.error(f"--delete-fraction can't be combined with --mixed or --multivector")
+            sys.exit(1)
+        values["delete_fraction"] = args.delete_fraction
+
+    if (args.target_recall) != None:
+        values["target_recalls"] = [float(x) for x in args.target_recall.split(",")]
+
+    labels = {}
+    if (args.labels) != None:
+        pairs = [l for l in args.labels.split(",")]
+        for pair in pairs:
+            kv = pair.split("=")
+            if len(kv) != 2:
+                logger.error(f"invalid labels, must be in format key_1=value_2,key_2=value_2")
+            labels[kv[0]] = kv[1]
+        values["labels"] = labels
+
+    values["quantization"] = args.quantization or False
+    values["override"] = args.override or False
+    values["query_only"] = args.query_only
+    values["rq_bits"] = int(args.rq_bits)
+    values["limit"] = args.limit
+    values["k"] = args.recall_k
+    values["import_workers"] = args.import_workers
+    values["profile_interval"] = args.profile_interval
+    values["cpu_profile_seconds"] = args.cpu_profile_seconds
+    values["import_sample_interval"] = args.import_sample_interval
+    values["compare_ef"] = args.compare_ef
+    values["mixed_duration"] = args.mixed_duration
+    values["mixed_workers"] = args.mixed_workers
+    values["mixed_ef"] = args.mixed_ef
+    values["delete_ef"] = args.delete_ef
+    values["cleanup_timeout"] = args.cleanup_timeout
+    values["adaptive_sample"] = args.adaptive_sample
+    values["open_loop_duration"] = args.open_loop_duration
+    values["arrivals"] = args.arrivals
+    values["index_cache"] = args.index_cache
+    if (args.dim_to_segment_ratio) != None:
+        values["dim_to_segment_ratio"] = int(args.dim_to_segment_ratio)
+        values["labels"]["dim_to_segment_ratio"] = values["dim_to_segment_ratio"]
+
+    values["multivector"] = args.multivector
+    values["multivector_implementation"] = args.multivector_implementation
+
+    stub = None
+    if "grpc_clientless" in values["apis"] or values["batch_sizes"]:
+        node = values["nodes"][0] if values["nodes"] else None
+        stub = SearchStub(
+            class_name,
+            f"{node.host}:{node.grpc_port}" if node else "localhost:50051",
+            multivector=values["multivector"],
+        )
+
+    # Add better error handling for file opening
+    try:
+        # Check if file exists
+        if not os.path.exists(args.vectors):
+            logger.error(f"Dataset file does not exist: {args.vectors}")
+            sys.exit(1)
+
+        # Check if file is empty
+        if os.path.getsize(args.vectors) == 0:
+            logger.error(f"Dataset file is empty: {args.vectors}")
+            sys.exit(1)
+
+        logger.info(
+            f"Opening dataset file: {args.vectors} (size: {os.path.getsize(args.vectors)} bytes)"
+        )
+        f = h5py.File(args.vectors)
+        logger.info(f"Successfully opened dataset file")
+    except OSError as e:
+        logger.error(f"Failed to open dataset file: {args.vectors}")
+        logger.error(f"Error details: {str(e)}")
+        logger.error(f"File exists: {os.path.exists(args.vectors)}")
+        logger.error(
+            f"File size: {os.path.getsize(args.vectors) if os.path.exists(args.vectors) else 'N/A'}"
+        )
+        logger.error(
+            f"File permissions: {oct(os.stat(args.vectors).st_mode)[-3:] if os.path.exists(args.vectors) else 'N/A'}"
+        )
+        sys.exit(1)
+
+    if values["multivector"]:
+        try:
+            values["multivector_dim"] = args.multivector_dim or multivector_dim(f)
+        except ValueError as e:
+            logger.error(f"{e}, pass --multivector-dim")
+            sys.exit(1)
+        logger.info(f"multivector dim={values['multivector_dim']}")
+
+    values["labels"]["dataset_file"] = os.path.basename(args.vectors)
+    print(values["labels"])
+    for shards in values["shards"]:
+        for m in values["m"]:
+            if values["compare_quantizations"] is None:
+                benchmark(
+                    client, stub, f, args, shards, m, values["quantization"], values["labels"]
+                )
+                continue
+
+            # same dataset and m for every compressor, linked by a shared comparison id
+            comparison_id = f"{int(time.time())}"
+            for quantization in values["compare_quantizations"]:
+                labels = {
+                    **values["labels"],
+                    "quantization": quantization,
+                    "comparison_id": comparison_id,
+                }
+                benchmark(client, stub, f, args, shards, m, quantization, labels)
+            report = compare_quantizations(
+                load_results("./results", "comparison_id = ?", (comparison_id,)),
+                values["compare_ef"],
+            )
+            print_report(report)
+            store_report(report, comparison_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from quantization_report import at_ef, print_report
+from results_store import load_results
+
+REPORTS_DIR = "./results/reports"
+GROUP = ["cluster_size", "shards", "concurrency"]
+COLUMNS = GROUP + [
+    "ef",
+    "recall",
+    "qps",
+    "qps_per_node",
+    "scaling_efficiency",
+    "p99",
+    "shard_imbalance",
+    "heap_mb",
+]
+
+
+def compare_scaling(df, ef=64):
+    """Builds one row per cluster size, shard count and concurrency.
+
+    Recall and QPS are taken at `ef` (or the closest measured ef), from the latest run of
+    every group. The scaling efficiency is the QPS per node relative to the QPS per node of
+    the smallest cluster with the fewest shards at the same concurrency, 1.0 is linear.
+    """
+    if "cluster_size" not in df:
+        return pd.DataFrame(columns=COLUMNS)
+    # closed-loop, unfiltered client queries at every concurrency
+    df = df[df["cluster_size"].notna() & (df["api"] == "grpc")]
+    for column in ["selectivity", "workload", "offered_qps"]:
+        if column in df:
+            df = df[df[column].isna()]
+
+    rows = []
+    for key, group in df.groupby(GROUP):
+        group = group[group["run_id"] == group["run_id"].max()]
+        point = at_ef(group, ef)
+        rows.append(
+            {
+                **dict(zip(GROUP, key)),
+                "ef": point["ef"],
+                "recall": point["recall"],
+                "qps": point["qps"],
+                "qps_per_node": point["qps"] / key[0],
+                "p99": point["p99"],
+                "shard_imbalance": point.get("shard_imbalance", np.nan),
+                "heap_mb": point["heap_mb"],
+            }
+        )
+    report = pd.DataFrame(rows, columns=[c for c in COLUMNS if c != "scaling_efficiency"])
+    baseline = report.sort_values(["cluster_size", "shards"]).groupby("concurrency").first()
+    report["scaling_efficiency"] = report["qps_per_node"] / report["concurrency"].map(
+        baseline["qps_per_node"]
+    )
+    return report[COLUMNS]
+
+
+def store_report(report, name, path=REPORTS_DIR):
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, f"scaling_{name}.csv")
+    logger.info(f"storing scaling report in {filename}")
+    report.to_csv(filename, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="compare QPS and recall across cluster sizes and shard counts"
+    )
+    parser.add_argument("--results-dir", default="./results")
+    parser.add_argument("--dataset-file", help="only runs on this dataset file")
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--store", help="also store the report as scaling_<name>.csv")
+    args = parser.parse_args()
+
+    df = load_results(args.results_dir)
+    if args.dataset_file and "dataset_file" in df:
+        df = df[df["dataset_file"] == args.dataset_file]
+    report = compare_scaling(df, args.ef)
+    print_report(report)
+    if args.store:
+        store_report(report, args.store)
@@ -0,0 +1,158 @@
+import time
+import urllib.request
+import uuid
+import numpy as np
+from weaviate.classes.query import Filter
+from loguru import logger
+
+from ground_truth import cache_dir_for, ground_truth
+from results_store import store_run
+from weaviate_query import measure, set_ef, class_name
+
+METRICS_ORIGIN = "http://localhost:2112"
+# ids per delete request, stays below the default QUERY_MAXIMUM_RESULTS
+DELETE_BATCH = 10000
+
+
+def fetch_metric(origin, name, timeout=10):
+    """Sums all series of the Prometheus metric `name` (e.g. across shards)."""
+    with urllib.request.urlopen(f"{origin}/metrics", timeout=timeout) as resp:
+        text = resp.read().decode()
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith(name) and line[len(name)] in "{ ":
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+def cleanup_state(origin):
+    """Returns the tombstone count and the number of threads currently cleaning them up."""
+    return (
+        fetch_metric(origin, "vector_index_tombstones"),
+        fetch_metric(origin, "vector_index_tombstone_cleanup_threads"),
+    )
+
+
+def pick_deleted(count, fraction, seed=0):
+    """The ids of a random `fraction` of the objects 0..count-1, fixed by `seed`."""
+    return np.sort(np.random.default_rng(seed).choice(count, int(count * fraction), replace=False))
+
+
+def delete_ids(collection, ids):
+    """Deletes the objects with the given ids by uuid, returns how long it took."""
+    before = time.time()
+    for start in range(0, len(ids), DELETE_BATCH):
+        uuids = [uuid.UUID(int=int(i)) for i in ids[start : start + DELETE_BATCH]]
+        res = collection.data.delete_many(where=Filter.by_id().contains_any(uuids))
+        if res.failed:
+            logger.error(f"failed to delete {res.failed} objects")
+    took = time.time() - before
+    logger.info(f"deleted {len(ids)} objects in {took:.1f}s, {len(ids) / took:.0f} objects/s")
+    return took
+
+
+def run_delete_benchmark(
+    client,
+    dataset,
+    distance,
+    fraction,
+    ef=64,
+    limit=10,
+    k=10,
+    probe_interval=10,
+    probe_queries=1000,
+    timeout=3600,
+    metrics_origin=METRICS_ORIGIN,
+    seed=0,
+):
+    """Deletes a fraction of the train set and follows recall and QPS until cleanup finished.
+
+    Recall is measured against an exact ground truth over the surviving objects. The deleted
+    ids are fixed by `seed`, so it is computed before the delete and the first point is taken
+    right after it. The full test set is run right after the delete and after cleanup; while
+    tombstones are being cleaned up a sample of `probe_queries` is run every `probe_interval`
+    seconds. Cleanup counts as running from the first sample with cleanup threads active (or
+    fewer tombstones than the peak) until no tombstones are left.
+    """
+    try:
+        cleanup_state(metrics_origin)
+    except OSError as e:
+        raise RuntimeError(
+            f"can't read tombstone metrics from {metrics_origin}, "
+            "start weaviate with PROMETHEUS_MONITORING_ENABLED=true"
+        ) from e
+    collection = client.collections.get(class_name)
+    set_ef(client, collection, ef)
+    train = dataset["train"]
+    queries = dataset["test"][:]
+    ids = pick_deleted(len(train), fraction, seed)
+    mask = np.ones(len(train), dtype=bool)
+    mask[ids] = False
+    neighbors, _ = ground_truth(
+        train, queries, max(k, limit), distance, mask, cache_dir_for(dataset.filename)
+    )
+    sample = np.random.default_rng(seed).choice(
+        len(queries), min(probe_queries, len(queries)), replace=False
+    )
+
+    delete_seconds = delete_ids(collection, ids)
+    deleted_at = time.time()
+
+    def point(phase, vectors, truth):
+        tombstones, threads = cleanup_state(metrics_origin)
+        metrics = measure("grpc", client, collection, None, vectors, truth, False, 1, limit, k)
+        logger.info(
+            f"{phase}: t={time.time() - deleted_at:.0f}s tombstones={tombstones:.0f} recall={metrics['recall']} qps={metrics['qps']}"
+        )
+        return {
+            "phase": phase,
+            "t": time.time() - deleted_at,
+            "tombstones": tombstones,
+            "cleanup_threads": threads,
+            **metrics,
+        }
+
+    points = [point("after_delete", queries, neighbors)]
+    peak = points[0]["tombstones"]
+    cleanup_started = cleanup_finished = None
+    while time.time() - deleted_at < timeout:
+        tombstones, threads = cleanup_state(metrics_origin)
+        peak = max(peak, tombstones)
+        now = time.time()
+        if cleanup_started is None and (threads > 0 or 0 < tombstones < peak):
+            cleanup_started = now
+        if tombstones == 0 and threads == 0:
+            cleanup_finished = now
+            break
+        if cleanup_started is not None:
+            points.append(point("during_cleanup", queries[sample], neighbors[sample]))
+        time.sleep(probe_interval)
+    else:
+        logger.warning(f"tombstones not cleaned up after {timeout}s")
+    points.append(point("after_cleanup", queries, neighbors))
+
+    if cleanup_finished is not None and cleanup_started is None:
+        # cleaned up between two samples
+        cleanup_started = cleanup_finished
+    cleanup_seconds = (
+        cleanup_finished - cleanup_started if cleanup_finished is not None else float("nan")
+    )
+    summary = {
+        "ef": ef,
+        "delete_fraction": fraction,
+        "deleted": len(ids),
+        "delete_seconds": delete_seconds,
+        "peak_tombstones": peak,
+        "cleanup_wait_seconds": (
+            cleanup_started - deleted_at if cleanup_started is not None else float("nan")
+        ),
+        "cleanup_seconds": cleanup_seconds,
+        "cleanup_seconds_per_million": cleanup_seconds / (peak / 1e6) if peak else float("nan"),
+    }
+    logger.info(f"delete benchmark: {summary}")
+    return points, summary
+
+
+def store(run_id, rows, path="./results"):
+    """Stores the delete benchmark rows as results of the run."""
+    store_run(run_id, "delete", rows, path=path)
@@ -2,18 +2,9 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import pandas as pd
 
-import os, glob
-import json
+from results_store import load_results
 
-datapoints = []
-
-path = "./results"
-for filename in glob.glob(os.path.join(path, "*.json")):
-    with open(os.path.join(os.getcwd(), filename), "r") as f:
-        parsed = json.loads(f.read())
-        datapoints += parsed
-df = pd.DataFrame(datapoints)
-df = df[df["after_restart"] == "false"]
+df = load_results("./results", where="after_restart = 'false'")
 
 sns.set_theme()
 plot = sns.relplot(
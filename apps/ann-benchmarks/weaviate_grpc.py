@@ -0,0 +1,151 @@
+import time
+import grpc
+import numpy as np
+
+from weaviate.proto.v1 import base_pb2, search_get_pb2
+
+GRPC_TARGET = "localhost:50051"
+SEARCH_METHOD = "/weaviate.v1.Weaviate/Search"
+MULTIVECTOR_TARGET = "multivector"
+# field numbers of the v1 SearchRequest/NearVector/Vectors messages written by hand below
+_SEARCH_NEAR_VECTOR = 43
+_NEAR_VECTOR_BYTES = 4
+_NEAR_VECTOR_VECTORS = 9
+_VECTORS_BYTES = 3
+_VECTORS_TYPE = 4
+# client-side segments of a query: building the request, waiting for the reply (transport
+# plus server search, a unary reply arrives as a whole) and parsing it
+SEGMENTS = ["encode", "ttfb", "decode"]
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number, payload):
+    """Encodes a length-delimited protobuf field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+class SearchStub:
+    """Searches Weaviate over a raw gRPC channel, bypassing the Python client.
+
+    The channel is opened once and kept. Everything but the query vector is serialized
+    once per limit; per query only the vector bytes are framed and appended, which
+    protobuf merges into the request on the server side.
+    """
+
+    def __init__(self, class_name, target=GRPC_TARGET, multivector=False):
+        self.class_name = class_name
+        self.multivector = multivector
+        self.channel = grpc.insecure_channel(
+            target,
+            options=[
+                ("grpc.max_send_message_length", -1),
+                ("grpc.max_receive_message_length", -1),
+            ],
+        )
+        self._search = self.channel.unary_unary(
+            SEARCH_METHOD,
+            request_serializer=None,
+            response_deserializer=search_get_pb2.SearchReply.FromString,
+        )
+        self._search_raw = self.channel.unary_unary(
+            SEARCH_METHOD, request_serializer=None, response_deserializer=None
+        )
+        self._templates = {}
+
+    def close(self):
+        self.channel.close()
+
+    def template(self, limit):
+        """The serialized request without the query vector."""
+        if limit not in self._templates:
+            request = search_get_pb2.SearchRequest(
+                collection=self.class_name,
+                limit=limit,
+                metadata=search_get_pb2.MetadataRequest(uuid=True),
+                properties=search_get_pb2.PropertiesRequest(),
+                uses_123_api=True,
+                uses_125_api=True,
+                uses_127_api=True,
+            )
+            if self.multivector:
+                request.near_vector.targets.target_vectors.append(MULTIVECTOR_TARGET)
+            self._templates[limit] = request.SerializeToString()
+        return self._templates[limit]
+
+    def request(self, vec, limit):
+        """Serializes the request for one query vector (or token matrix if multivector)."""
+        vec = np.asarray(vec, dtype="<f4")
+        if not self.multivector:
+            near_vector = _field(_NEAR_VECTOR_BYTES, vec.tobytes())
+        else:
+            # multi vectors are prefixed with the (uint16) dimension of a token
+            vectors = _field(
+                _VECTORS_BYTES, np.uint16(vec.shape[1]).astype("<u2").tobytes() + vec.tobytes()
+            ) + bytes([_VECTORS_TYPE << 3, base_pb2.Vectors.VECTOR_TYPE_MULTI_FP32])
+            near_vector = _field(_NEAR_VECTOR_VECTORS, vectors)
+        return self.template(limit) + _field(_SEARCH_NEAR_VECTOR, near_vector)
+
+    def search(self, vec, limit):
+        return self._search(self.request(vec, limit))
+
+    def search_timed(self, vec, limit):
+        """Like search, but also returns the duration of every segment (see SEGMENTS)."""
+        before = time.perf_counter()
+        request = self.request(vec, limit)
+        encoded = time.perf_counter()
+        data = self._search_raw(request)
+        received = time.perf_counter()
+        reply = search_get_pb2.SearchReply.FromString(data)
+        decoded = time.perf_counter()
+        return reply, {
+            "encode": encoded - before,
+            "ttfb": received - encoded,
+            "decode": decoded - received,
+        }
+
+    def search_many(self, vecs, limit):
+        """Pipelines one request per vector over the channel, then waits for all replies."""
+        futures = [self._search.future(self.request(vec, limit)) for vec in vecs]
+        return [future.result() for future in futures]
+
+
+def search_grpc_clientless(stub, vec, limit):
+    """Like search_grpc, but over the raw channel of `stub`.
+
+    Besides the client-side duration (`took`) it returns the server-side one and the
+    client-side segments.
+    """
+    reply, segments = stub.search_timed(vec, limit)
+    return {
+        "took": sum(segments.values()),
+        "server_took": reply.took,
+        **segments,
+        "ids": [int.from_bytes(r.metadata.id_as_bytes, "big") for r in reply.results],
+    }
+
+
+def search_grpc_pipelined(stub, vecs, limit):
+    """Sends all `vecs` as one group of pipelined requests over the channel of `stub`.
+
+    `took` is the duration of the whole group, which is what a caller issuing many queries
+    per request waits for; `server_took` is the slowest query on the server.
+    """
+    before = time.time()
+    replies = stub.search_many(vecs, limit)
+    took = time.time() - before
+    return {
+        "took": took,
+        "server_took": max(reply.took for reply in replies),
+        "ids": [
+            [int.from_bytes(r.metadata.id_as_bytes, "big") for r in reply.results]
+            for reply in replies
+        ],
+    }
@@ -1,13 +1,18 @@
 import os
 import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
 from typing import Optional
 import uuid
 import weaviate
 import weaviate.classes.config as wvc
 import h5py
+import numpy as np
 import time
 
+from dataset_reader import iter_vectors, token_stats
+
 CLASS_NAME = "Vector"
 
 
@@ -78,31 +83,50 @@ def reset_schema(
     )
 
 
-def load_records(
+QUANTIZATIONS = ["pq", "sq", "bq", "rq"]
+# number of objects imported before the import is paused to enable quantization
+QUANTIZATION_PAUSE = 100000
+# multivector datasets store each document as a flat array of token vectors, of this
+# dimension unless derived from the dataset (see dataset_reader.multivector_dim)
+MULTIVECTOR_DIM = 128
+# shared counter of objects handed to the batch (see import_monitor), and its granularity
+sent_counter = None
+SENT_COUNT_EVERY = 1000
+
+
+def _count_sent(n):
+    if sent_counter is not None and n > 0:
+        with sent_counter.get_lock():
+            sent_counter.value += n
+
+
+def write_records(
     client: weaviate.WeaviateClient,
     vectors,
-    quantization,
-    dim_to_seg_ratio,
-    override,
+    start,
+    stop,
     multivector=False,
-    multivector_implementation="regular",
-    rq_bits=8,
+    multivector_dim=MULTIVECTOR_DIM,
 ):
-    collection = client.collections.get(CLASS_NAME)
-    i = 0
-    if vectors == None:
-        vectors = [None] * 10_000_000
+    """Imports vectors[start:stop], returns the number of failed objects and, for multivector
+    datasets, the token count of every imported document (counted here so that the train set
+    is only read once).
+    """
     batch_size = 100
     len_objects = len(vectors)
+    sent = 0
+    tokens = np.zeros(max(0, min(stop, len_objects) - start) if multivector else 0, np.int32)
 
     with client.batch.fixed_size(batch_size=batch_size) as batch:
-        for vector in vectors:
-            if i == 100000 and quantization in ["pq", "sq", "bq", "rq"] and override == False:
-                logger.info(f"pausing import to enable quantization")
-                break
-
+        for i, vector in iter_vectors(
+            vectors, start, stop, multivector_dim if multivector else None
+        ):
             if i % 10000 == 0:
                 logger.info(f"writing record {i}/{len_objects}")
+            if sent == SENT_COUNT_EVERY:
+                _count_sent(sent)
+                sent = 0
+            sent += 1
 
             data_object = {
                 "i": i,
@@ -110,59 +134,76 @@ def load_records(
             multivector_object = {}
             if multivector:
                 multivector_object["multivector"] = vector
+                tokens[i - start] = len(vector)
             batch.add_object(
                 properties=data_object,
                 vector=vector if multivector is False else multivector_object,
                 uuid=uuid.UUID(int=i),
                 collection=CLASS_NAME,
             )
-            i += 1
+    _count_sent(sent)
 
     for err in client.batch.failed_objects:
         logger.error(err.message)
+    return len(client.batch.failed_objects), tokens
 
-    if quantization in ["pq", "sq", "bq", "rq"] and override == False:
-        if quantization == "pq":
-            if multivector is False:
-                collection.config.update(
-                    vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                        quantizer=wvc.Reconfigure.VectorIndex.Quantizer.pq(
-                            segments=int(len(vectors[0]) / dim_to_seg_ratio),
-                        ),
-                    )
+
+def enable_quantization(
+    collection: weaviate.collections.Collection,
+    quantization,
+    dim,
+    dim_to_seg_ratio,
+    multivector=False,
+    rq_bits=8,
+):
+    if quantization == "pq":
+        if multivector is False:
+            collection.config.update(
+                vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                    quantizer=wvc.Reconfigure.VectorIndex.Quantizer.pq(
+                        segments=int(dim / dim_to_seg_ratio),
+                    ),
                 )
-            else:
-                collection.config.update(
-                    vectorizer_config=[
-                        wvc.Reconfigure.NamedVectors.update(
-                            name="multivector",
-                            vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                                quantizer=wvc.Reconfigure.VectorIndex.Quantizer.pq(
-                                    segments=int(len(vectors[0][0]) / dim_to_seg_ratio),
-                                ),
+            )
+        else:
+            collection.config.update(
+                vectorizer_config=[
+                    wvc.Reconfigure.NamedVectors.update(
+                        name="multivector",
+                        vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                            quantizer=wvc.Reconfigure.VectorIndex.Quantizer.pq(
+                                segments=int(dim / dim_to_seg_ratio),
                             ),
-                        )
-                    ]
-                )
-        elif quantization == "sq":
-            if multivector is False:
-                collection.config.update(
-                    vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                        quantizer=wvc.Reconfigure.VectorIndex.Quantizer.sq(),
+                        ),
                     )
+                ]
+            )
+    elif quantization == "sq":
+        if multivector is False:
+            collection.config.update(
+                vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                    quantizer=wvc.Reconfigure.VectorIndex.Quantizer.sq(),
                 )
-            else:
-                collection.config.update(
-                    vectorizer_config=[
-                        wvc.Reconfigure.NamedVectors.update(
-                            name="multivector",
-                            vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                                quantizer=wvc.Reconfigure.VectorIndex.Quantizer.sq(),
-                            ),
-                        )
-                    ]
+            )
+        else:
+            collection.config.update(
+                vectorizer_config=[
+                    wvc.Reconfigure.NamedVectors.update(
+                        name="multivector",
+                        vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                            quantizer=wvc.Reconfigure.VectorIndex.Quantizer.sq(),
+                        ),
+                    )
+                ]
+            )
+    elif quantization == "bq":
+        if multivector is False:
+            collection.config.update(
+                vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                    quantizer=wvc.Reconfigure.VectorIndex.Quantizer.bq(),
                 )
-        elif quantization == "bq" and multivector is True:
+            )
+        else:
             collection.config.update(
                 vectorizer_config=[
                     wvc.Reconfigure.NamedVectors.update(
@@ -173,59 +214,219 @@ def load_records(
                     )
                 ]
             )
-        elif quantization == "rq":
-            logger.info(f"Updating rq bits to {rq_bits}")
-            if multivector is False:
-                collection.config.update(
-                    vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                        quantizer=wvc.Reconfigure.VectorIndex.Quantizer.rq(bits=rq_bits),
-                    )
-                )
-            else:
-                collection.config.update(
-                    vectorizer_config=[
-                        wvc.Reconfigure.NamedVectors.update(
-                            name="multivector",
-                            vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
-                                quantizer=wvc.Reconfigure.VectorIndex.Quantizer.rq(bits=rq_bits),
-                            ),
-                        )
-                    ]
+    elif quantization == "rq":
+        logger.info(f"Updating rq bits to {rq_bits}")
+        if multivector is False:
+            collection.config.update(
+                vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                    quantizer=wvc.Reconfigure.VectorIndex.Quantizer.rq(bits=rq_bits),
                 )
+            )
+        else:
+            collection.config.update(
+                vectorizer_config=[
+                    wvc.Reconfigure.NamedVectors.update(
+                        name="multivector",
+                        vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(
+                            quantizer=wvc.Reconfigure.VectorIndex.Quantizer.rq(bits=rq_bits),
+                        ),
+                    )
+                ]
+            )
+
+
+def load_records(
+    client: weaviate.WeaviateClient,
+    vectors,
+    quantization,
+    dim_to_seg_ratio,
+    override,
+    multivector=False,
+    multivector_implementation="regular",
+    rq_bits=8,
+    multivector_dim=MULTIVECTOR_DIM,
+):
+    collection = client.collections.get(CLASS_NAME)
+    if vectors == None:
+        vectors = [None] * 10_000_000
+    len_objects = len(vectors)
+
+    pause = quantization in QUANTIZATIONS and override == False
+    _, tokens = write_records(
+        client,
+        vectors,
+        0,
+        min(QUANTIZATION_PAUSE, len_objects) if pause else len_objects,
+        multivector,
+        multivector_dim,
+    )
+
+    if pause:
+        logger.info(f"pausing import to enable quantization")
+        dim = len(vectors[0]) if multivector is False else multivector_dim
+        enable_quantization(collection, quantization, dim, dim_to_seg_ratio, multivector, rq_bits)
 
         check_shards_readonly(collection)
         wait_for_all_shards_ready(client)
 
-        i = 100000
-        with client.batch.fixed_size(batch_size=batch_size) as batch:
-            while i < len_objects:
-                vector = vectors[i]
-                if i % 10000 == 0:
-                    logger.info(f"writing record {i}/{len_objects}")
-
-                data_object = {
-                    "i": i,
-                }
-
-                multivector_object = {}
-                if multivector:
-                    multivector_object["multivector"] = vector
-                batch.add_object(
-                    properties=data_object,
-                    vector=vector if multivector is False else multivector_object,
-                    uuid=uuid.UUID(int=i),
-                    collection=CLASS_NAME,
-                )
-                i += 1
+        _, more_tokens = write_records(
+            client, vectors, QUANTIZATION_PAUSE, len_objects, multivector, multivector_dim
+        )
+        tokens = np.concatenate([tokens, more_tokens])
+
+    logger.info("Waiting for vector indexing to finish")
+    collection.batch.wait_for_vector_indexing()
+    logger.info("Vector indexing finished")
+
+    logger.info(f"Finished writing {len_objects} records")
+    return token_stats(tokens)
+
+
+def _init_worker(counter):
+    global sent_counter
+    sent_counter = counter
+
+
+def _import_worker(
+    path, start, stop, multivector=False, multivector_dim=MULTIVECTOR_DIM, node=None
+):
+    """Imports the train vectors [start, stop) of the HDF5 file at `path` with its own client.
+
+    The client connects to `node` (a cluster.Node) if given, to localhost otherwise.
+    """
+    if node is None:
+        client = weaviate.connect_to_local()
+    else:
+        client = weaviate.connect_to_local(
+            host=node.host, port=node.http_port, grpc_port=node.grpc_port
+        )
+    try:
+        with h5py.File(path, "r") as f:
+            before = time.time()
+            failed, tokens = write_records(
+                client, f["train"], start, stop, multivector, multivector_dim
+            )
+            return {
+                "start": start,
+                "stop": stop,
+                "failed": failed,
+                "tokens": tokens,
+                "took": time.time() - before,
+            }
+    finally:
+        client.close()
+
+
+def split_range(start, stop, parts):
+    """Splits [start, stop) into at most `parts` contiguous, nearly equal ranges."""
+    size = stop - start
+    bounds = [start + size * p // parts for p in range(parts + 1)]
+    return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def import_parallel(
+    path,
+    start,
+    stop,
+    workers,
+    multivector=False,
+    multivector_dim=MULTIVECTOR_DIM,
+    nodes=None,
+):
+    """Imports [start, stop) with one process (and client) per uuid range, logging throughput.
+
+    With `nodes` the workers connect to them round-robin.
+    """
+    ranges = split_range(start, stop, workers)
+    if len(ranges) == 0:
+        return [], 0
+    before = time.time()
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=len(ranges),
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(sent_counter,),
+    ) as pool:
+        stats = list(
+            pool.map(
+                _import_worker,
+                *zip(*[(path, lo, hi, multivector, multivector_dim) for lo, hi in ranges]),
+                [nodes[i % len(nodes)] if nodes else None for i in range(len(ranges))],
+            )
+        )
+    took = time.time() - before
+
+    for worker, s in enumerate(stats):
+        logger.info(
+            f"worker {worker} imported [{s['start']}, {s['stop']}) in {s['took']:.1f}s, "
+            f"{(s['stop'] - s['start']) / s['took']:.0f} objects/s, {s['failed']} failed"
+        )
+    logger.info(
+        f"imported {stop - start} objects in {took:.1f}s, {(stop - start) / took:.0f} objects/s"
+    )
+    return stats, took
+
+
+def load_records_parallel(
+    client: weaviate.WeaviateClient,
+    path,
+    workers,
+    quantization,
+    dim_to_seg_ratio,
+    override,
+    multivector=False,
+    multivector_implementation="regular",
+    rq_bits=8,
+    multivector_dim=MULTIVECTOR_DIM,
+    nodes=None,
+):
+    """Like load_records, but splits the train set of the HDF5 file at `path` into uuid
+    ranges that are imported by `workers` processes in parallel, spread over `nodes` if given.
+
+    Returns per-worker and aggregate throughput of the import, and the token stats of
+    multivector documents.
+    """
+    collection = client.collections.get(CLASS_NAME)
+    with h5py.File(path, "r") as f:
+        len_objects = len(f["train"])
+        dim = len(f["train"][0]) if multivector is False else multivector_dim
+
+    pause = quantization in QUANTIZATIONS and override == False
+    stats, took = import_parallel(
+        path,
+        0,
+        min(QUANTIZATION_PAUSE, len_objects) if pause else len_objects,
+        workers,
+        multivector,
+        multivector_dim,
+        nodes,
+    )
+
+    if pause:
+        logger.info(f"pausing import to enable quantization")
+        enable_quantization(collection, quantization, dim, dim_to_seg_ratio, multivector, rq_bits)
+
+        check_shards_readonly(collection)
+        wait_for_all_shards_ready(client)
 
-        for err in client.batch.failed_objects:
-            logger.error(err.message)
+        more_stats, more_took = import_parallel(
+            path, QUANTIZATION_PAUSE, len_objects, workers, multivector, multivector_dim, nodes
+        )
+        stats += more_stats
+        took += more_took
 
     logger.info("Waiting for vector indexing to finish")
     collection.batch.wait_for_vector_indexing()
     logger.info("Vector indexing finished")
 
     logger.info(f"Finished writing {len_objects} records")
+    return {
+        "import_workers": workers,
+        "import_objects_per_second": len_objects / took if took > 0 else 0,
+        "import_worker_objects_per_second": [(s["stop"] - s["start"]) / s["took"] for s in stats],
+        **token_stats(np.concatenate([s["tokens"] for s in stats]) if stats else []),
+    }
 
 
 def check_shards_readonly(collection: weaviate.collections.Collection):
@@ -1,20 +1,263 @@
-import subprocess
-import re
+import gzip
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from loguru import logger
+
+from results_store import store_run
+
+PPROF_ORIGIN = "http://localhost:6060"
+MB = 1024 * 1024
+
+
+def _varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """Yields (field number, wire type, value) of a protobuf message."""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 2:
+            size, pos = _varint(buf, pos)
+            value = buf[pos : pos + size]
+            pos += size
+        elif wire == 1:
+            value, pos = buf[pos : pos + 8], pos + 8
+        elif wire == 5:
+            value, pos = buf[pos : pos + 4], pos + 4
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire}")
+        yield field, wire, value
+
+
+def _repeated(value, wire):
+    """Decodes a repeated integer field, which may or may not be packed."""
+    if wire == 0:
+        return [value]
+    out = []
+    pos = 0
+    while pos < len(value):
+        v, pos = _varint(value, pos)
+        out.append(v)
+    return out
+
+
+def _int64(v):
+    return v - (1 << 64) if v >= 1 << 63 else v
+
+
+def parse_profile(data):
+    """Parses a (gzipped) pprof protobuf profile as served by /debug/pprof.
+
+    Only the parts needed to attribute sample values to functions are decoded. Returns a
+    dict with the sample types, the samples as (location ids, values) and a map from
+    location id to the name of its innermost function.
+    """
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    buf = memoryview(data)
+
+    strings, sample_types, samples = [], [], []
+    location_functions, function_names = {}, {}
+    duration_nanos = 0
+    for field, wire, value in _fields(buf):
+        if field == 1:
+            vt = dict((f, v) for f, _, v in _fields(value))
+            sample_types.append((vt.get(1, 0), vt.get(2, 0)))
+        elif field == 2:
+            location_ids, values = [], []
+            for f, w, v in _fields(value):
+                if f == 1:
+                    location_ids += _repeated(v, w)
+                elif f == 2:
+                    values += [_int64(x) for x in _repeated(v, w)]
+            samples.append((location_ids, values))
+        elif field == 4:
+            location_id, function_id = 0, None
+            for f, _, v in _fields(value):
+                if f == 1:
+                    location_id = v
+                elif f == 4 and function_id is None:
+                    # the first line is the innermost function when calls are inlined
+                    function_id = dict((lf, lv) for lf, _, lv in _fields(v)).get(1)
+            location_functions[location_id] = function_id
+        elif field == 5:
+            fn = dict((f, v) for f, _, v in _fields(value))
+            function_names[fn.get(1, 0)] = fn.get(2, 0)
+        elif field == 6:
+            strings.append(bytes(value).decode("utf-8", errors="replace"))
+        elif field == 10:
+            duration_nanos = value
+
+    return {
+        "sample_types": [(strings[t], strings[u]) for t, u in sample_types],
+        "samples": samples,
+        "locations": {
+            loc: strings[function_names.get(fn, 0)] if fn is not None else "?"
+            for loc, fn in location_functions.items()
+        },
+        "duration_seconds": duration_nanos / 1e9,
+    }
+
+
+def fetch_profile(origin, path="/debug/pprof/heap", timeout=30):
+    with urllib.request.urlopen(f"{origin}{path}", timeout=timeout) as resp:
+        return parse_profile(resp.read())
+
+
+def totals(profile):
+    """Sums every sample type over all samples."""
+    out = [0] * len(profile["sample_types"])
+    for _, values in profile["samples"]:
+        for i, v in enumerate(values):
+            out[i] += v
+    return {name: total for (name, _), total in zip(profile["sample_types"], out)}
+
+
+def top_functions(profile, sample_type, top=10):
+    """Returns the `top` functions by flat value of `sample_type`, like `pprof -top`."""
+    index = [name for name, _ in profile["sample_types"]].index(sample_type)
+    flat = defaultdict(int)
+    for location_ids, values in profile["samples"]:
+        if location_ids:
+            flat[profile["locations"].get(location_ids[0], "?")] += values[index]
+    return sorted(flat.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def heap_summary(profile, top=10):
+    t = totals(profile)
+    return {
+        "inuse_mb": t.get("inuse_space", 0) / MB,
+        "alloc_mb": t.get("alloc_space", 0) / MB,
+        "top": [
+            {"function": fn, "inuse_mb": v / MB}
+            for fn, v in top_functions(profile, "inuse_space", top)
+        ],
+    }
 
 
 def obtain_heap_profile(origin):
-    ping = subprocess.run(
-        ["go", "tool", "pprof", "-top", "-unit=MB", f"{origin}/debug/pprof/heap"],
-        text=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        check=True,
-    )
-    for line in ping.stdout.split("\n"):
-        if "MB total" in line:
-            result = re.search(r"of (\b[0-9]+\.[0-9]+)MB total", line)
-            groups = result.groups()
-            if len(groups) == 1:
-                return float(groups[0])
-
-    raise Exception("could not extract heap value")
+    """Returns the in-use heap in MB, the same number `go tool pprof -top` reports as total."""
+    return heap_summary(fetch_profile(origin), top=0)["inuse_mb"]
+
+
+def cpu_summary(profile, top=10):
+    cpu_seconds = totals(profile).get("cpu", 0) / 1e9
+    duration = profile["duration_seconds"]
+    return {
+        "duration_s": duration,
+        "cpu_s": cpu_seconds,
+        "cores": cpu_seconds / duration if duration > 0 else 0,
+        "top": [{"function": fn, "cpu_s": v / 1e9} for fn, v in top_functions(profile, "cpu", top)],
+    }
+
+
+class Profiler:
+    """Samples the heap profile in the background and captures CPU profile windows.
+
+    Heap samples are tagged with the current phase (e.g. import, query). All data is kept
+    in memory and written next to the results with `store`. With `origins` every node of a
+    cluster is profiled and the samples are tagged with the node's origin.
+    """
+
+    def __init__(self, origin=PPROF_ORIGIN, interval=10, top=10, cpu_seconds=0, origins=None):
+        self.origin = origin
+        self.origins = origins or [origin]
+        self.interval = interval
+        self.top = top
+        self.cpu_seconds = cpu_seconds
+        self.phase = None
+        self.heap_samples = []
+        self.cpu_profiles = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, phase):
+        self.phase = phase
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def set_phase(self, phase):
+        self.phase = phase
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _tags(self, origin):
+        return {"node": origin} if len(self.origins) > 1 else {}
+
+    def _sample(self):
+        while not self._stop.is_set():
+            for origin in self.origins:
+                try:
+                    summary = heap_summary(fetch_profile(origin), self.top)
+                    self.heap_samples.append(
+                        {"t": time.time(), "phase": self.phase, **self._tags(origin), **summary}
+                    )
+                except Exception as e:
+                    logger.warning(f"could not sample heap profile of {origin}: {e}")
+            self._stop.wait(self.interval)
+
+    @contextmanager
+    def cpu_window(self, **tags):
+        """Captures a CPU profile of up to `cpu_seconds` while the block runs."""
+        if self.cpu_seconds <= 0:
+            yield
+            return
+
+        def capture(origin):
+            try:
+                profile = fetch_profile(
+                    origin,
+                    f"/debug/pprof/profile?seconds={self.cpu_seconds}",
+                    timeout=self.cpu_seconds + 30,
+                )
+                self.cpu_profiles.append(
+                    {
+                        "t": started,
+                        "phase": self.phase,
+                        **self._tags(origin),
+                        **tags,
+                        **cpu_summary(profile, self.top),
+                    }
+                )
+            except Exception as e:
+                logger.warning(f"could not capture cpu profile of {origin}: {e}")
+
+        started = time.time()
+        threads = [
+            threading.Thread(target=capture, args=(origin,), daemon=True) for origin in self.origins
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            yield
+        finally:
+            for thread in threads:
+                thread.join()
+
+    def store(self, run_id, path="./results"):
+        store_run(
+            run_id,
+            "profiles",
+            samples={"heap_samples": self.heap_samples, "cpu_profiles": self.cpu_profiles},
+            path=path,
+        )
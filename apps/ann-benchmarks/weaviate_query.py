@@ -1,37 +1,59 @@
 import grpc
 import time
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 import argparse
 import weaviate
 import weaviate.classes.config as wvc
+from weaviate.classes.query import Filter
 from weaviate.exceptions import WeaviateQueryException
 import h5py
-import torch
-import json
+from contextlib import nullcontext
+import numpy as np
 from loguru import logger
 
-from weaviate_pprof import obtain_heap_profile
-from weaviate_import import wait_for_all_shards_ready
+from latency import latency_summary
+from recall import result_ids, recall_summary, RECALL_AT
+
+from weaviate_pprof import obtain_heap_profile, PPROF_ORIGIN
+from weaviate_import import wait_for_all_shards_ready, MULTIVECTOR_DIM
+from weaviate_grpc import SearchStub, search_grpc_clientless, search_grpc_pipelined, SEGMENTS
+from open_loop import sweep
+from results_store import store_run
+from dataset_reader import load_vectors
+from ground_truth import load_neighbors, cache_dir_for, ground_truth
+from cluster import BalancedCollection, connect
 
 limit = 10
 class_name = "Vector"
-results = []
+# apis the query loop measures one query at a time with, the async and pipelined rows come
+# from the open-loop sweep and the batch sizes
+APIS = ["grpc", "grpc_clientless"]
+# bounds of the adaptive ef search and the relative width at which bisection stops
+EF_MIN = 16
+EF_MAX = 512
+EF_TOLERANCE = 0.1
 
 
 def search_grpc(
-    collection: weaviate.collections.Collection, dataset, i, input_vec, multivector=False
+    collection: weaviate.collections.Collection,
+    input_vec,
+    multivector=False,
+    limit=limit,
+    filters=None,
 ):
     out = {}
     before = time.time()
     try:
         if not multivector:
             objs = collection.query.near_vector(
-                near_vector=input_vec, limit=limit, return_properties=[]
+                near_vector=input_vec, limit=limit, filters=filters, return_properties=[]
             ).objects
         else:
             objs = collection.query.near_vector(
                 near_vector=input_vec,
                 limit=limit,
+                filters=filters,
                 target_vector="multivector",
                 return_properties=[],
             ).objects
@@ -40,94 +62,519 @@ def search_grpc(
         objs = []
 
     out["took"] = time.time() - before
+    out["ids"] = [obj.uuid.int for obj in objs]
+    return out
 
-    ideal_neighbors = set(x for x in dataset["neighbors"][i][:limit])
-    res_ids = [obj.uuid.int for obj in objs]
 
-    out["recall"] = len(ideal_neighbors.intersection(res_ids)) / limit
-    return out
+def search(api, client, collection, stub, vec, multivector=False, limit=limit, filters=None):
+    if api == "grpc":
+        return search_grpc(collection, vec.tolist(), multivector, limit, filters)
+    elif api == "grpc_clientless":
+        return search_grpc_clientless(stub, vec, limit)
+    else:
+        raise ValueError(f"unknown api {api}")
+
+
+def run_queries(
+    api,
+    client,
+    collection,
+    stub,
+    vectors,
+    multivector=False,
+    concurrency=1,
+    limit=limit,
+    filters=None,
+):
+    """Runs every query vector with up to `concurrency` requests in flight.
+
+    Returns the per-query results in input order and the wall-clock duration of the run.
+    """
+    before = time.time()
+    if concurrency == 1:
+        res = [
+            search(api, client, collection, stub, vec, multivector, limit, filters)
+            for vec in vectors
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            res = list(
+                pool.map(
+                    lambda vec: search(
+                        api, client, collection, stub, vec, multivector, limit, filters
+                    ),
+                    vectors,
+                )
+            )
+    return res, time.time() - before
+
+
+def measure(
+    api,
+    client,
+    collection,
+    stub,
+    vectors,
+    neighbors,
+    multivector=False,
+    concurrency=1,
+    limit=limit,
+    k=limit,
+    filters=None,
+    tokens=None,
+):
+    """Runs all query vectors once and returns their latency, throughput and recall.
+
+    With the `tokens` of every (multivector) query the latency is also broken down by
+    query token count, see latency_by_tokens.
+    """
+    res, elapsed = run_queries(
+        api, client, collection, stub, vectors, multivector, concurrency, limit, filters
+    )
 
+    latencies = np.fromiter((r["took"] for r in res), dtype=np.float64, count=len(res))
+    latency = latency_summary(latencies)
+    if res and "server_took" in res[0]:
+        # the raw gRPC path also reports the server-side time, the rest is client/network
+        server = latency_summary([r["server_took"] for r in res])
+        latency.update({"server_mean": server["mean"], "server_p99": server["p99"]})
+    if res and SEGMENTS[0] in res[0]:
+        segments = {s: [r[s] for r in res] for s in SEGMENTS}
+        # what is left of the wait for the reply after the server-side search
+        segments["transport"] = [r["ttfb"] - r["server_took"] for r in res]
+        for name, values in segments.items():
+            summary = latency_summary(values)
+            latency.update({f"{name}_mean": summary["mean"], f"{name}_p99": summary["p99"]})
+    if tokens is not None:
+        latency.update(latency_by_tokens(tokens, latencies))
+    recalls = recall_summary(result_ids([r["ids"] for r in res], limit), neighbors, k)
+    # a single client keeps qps=1/mean so it stays comparable with older runs,
+    # concurrent runs report the aggregate throughput across all clients
+    qps = 1 / latency["mean"] if concurrency == 1 else len(vectors) / elapsed
+    return {
+        "concurrency": concurrency,
+        **latency,
+        "qps": qps,
+        "limit": limit,
+        "k": k,
+        **recalls,
+    }
 
-def query(client: weaviate.WeaviateClient, stub, dataset, ef_values, labels, multivector=False):
+
+def latency_by_tokens(tokens, latencies, bins=10):
+    """Relates the latency of multivector queries to their token count.
+
+    Returns the fitted latency per additional query token and, under "token_buckets", the
+    latency summary of every token count (or of `bins` quantile ranges of token counts if
+    there are more distinct counts than that).
+    """
+    tokens = np.asarray(tokens)
+    distinct = np.unique(tokens)
+    if len(distinct) <= bins:
+        groups = [tokens == t for t in distinct]
+    else:
+        edges = np.unique(np.quantile(tokens, np.linspace(0, 1, bins + 1)).astype(np.int64))
+        groups = [
+            (tokens >= lo) & ((tokens < hi) if hi < edges[-1] else (tokens <= hi))
+            for lo, hi in zip(edges[:-1], edges[1:])
+        ]
+    buckets = [
+        {
+            "tokens_min": int(tokens[mask].min()),
+            "tokens_max": int(tokens[mask].max()),
+            "queries": int(mask.sum()),
+            **latency_summary(latencies[mask]),
+        }
+        for mask in groups
+        if mask.any()
+    ]
+    slope = np.polyfit(tokens, latencies, 1)[0] if len(distinct) > 1 else float("nan")
+    return {"latency_per_token": float(slope), "token_buckets": buckets}
+
+
+def add_client_overhead(rows):
+    """Adds the client library overhead to the client api rows.
+
+    It is the mean latency of the client minus the one of the raw channel measured under the
+    same conditions, so it covers the client's request building, response decoding and
+    anything else it does around the call.
+    """
+    raw = {
+        (r["concurrency"], r["selectivity"]): r["mean"]
+        for r in rows
+        if r["api"] == "grpc_clientless"
+    }
+    for r in rows:
+        key = (r.get("concurrency"), r.get("selectivity"))
+        if r["api"] == "grpc" and key in raw:
+            r["client_overhead_mean"] = r["mean"] - raw[key]
+
+
+def measure_pipelined(stub, vectors, neighbors, batch_size, limit=limit, k=limit):
+    """Runs the query vectors in groups of `batch_size` pipelined requests over one channel.
+
+    Latencies are per group, QPS counts the individual queries.
+    """
+    before = time.time()
+    res = [
+        search_grpc_pipelined(stub, vectors[start : start + batch_size], limit)
+        for start in range(0, len(vectors), batch_size)
+    ]
+    elapsed = time.time() - before
+    latency = latency_summary([r["took"] for r in res])
+    server = latency_summary([r["server_took"] for r in res])
+    ids = result_ids([ids for r in res for ids in r["ids"]], limit)
+    return {
+        "concurrency": 1,
+        "batch_size": batch_size,
+        **latency,
+        "server_mean": server["mean"],
+        "server_p99": server["p99"],
+        "qps": len(vectors) / elapsed,
+        "limit": limit,
+        "k": k,
+        **recall_summary(ids, neighbors, k),
+    }
+
+
+def selectivity_filter(selectivity, count):
+    """Builds a range filter on `i` that matches `selectivity` of the `count` objects.
+
+    Returns the filter and the number of matching objects; None means unfiltered.
+    """
+    if selectivity is None:
+        return None, count
+    matches = max(1, int(round(selectivity * count)))
+    return Filter.by_property("i").less_than(matches), matches
+
+
+def set_ef(client, collection, ef, multivector=False):
+    """Updates ef of the vector index and waits until every shard applied it."""
+    if not multivector:
+        collection.config.update(vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(ef=ef))
+    else:
+        collection.config.update(
+            vectorizer_config=[
+                wvc.Reconfigure.NamedVectors.update(
+                    name="multivector",
+                    vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(ef=ef),
+                )
+            ]
+        )
+    wait_for_all_shards_ready(client)
+
+
+def bisect_ef(recall_at, target, low=EF_MIN, high=EF_MAX, tolerance=EF_TOLERANCE):
+    """Finds the smallest ef in [low, high] for which `recall_at(ef)` reaches `target`.
+
+    Recall is assumed to grow with ef. The interval is split geometrically (ef values are
+    spread over orders of magnitude) until it is narrower than `tolerance` of its lower end.
+    Returns `high` if even that misses the target.
+    """
+    if recall_at(high) < target:
+        logger.warning(f"recall {target} not reached at ef={high}")
+        return high
+    if recall_at(low) >= target:
+        return low
+    while high - low > max(1, low * tolerance):
+        mid = int(round((low * high) ** 0.5))
+        if mid <= low or mid >= high:
+            break
+        if recall_at(mid) >= target:
+            high = mid
+        else:
+            low = mid
+    return high
+
+
+def adaptive_ef_values(
+    client,
+    collection,
+    stub,
+    vectors,
+    neighbors,
+    targets,
+    multivector=False,
+    limit=limit,
+    k=limit,
+    sample=1000,
+):
+    """Picks an ef per recall target by bisecting on a subsample of the test queries.
+
+    Recall measured per ef is shared across targets, so later targets mostly reuse the
+    points measured for earlier ones. Returns a dict of ef to the target it was chosen for.
+    """
+    rng = np.random.default_rng(0)
+    rows = np.sort(rng.choice(len(vectors), min(sample, len(vectors)), replace=False))
+    vectors, neighbors = [vectors[i] for i in rows], neighbors[rows]
+    measured = {}
+
+    def recall_at(ef):
+        if ef not in measured:
+            set_ef(client, collection, ef, multivector)
+            metrics = measure(
+                "grpc", client, collection, stub, vectors, neighbors, multivector, 1, limit, k
+            )
+            measured[ef] = metrics["recall"]
+            logger.info(f"adaptive ef search: ef={ef}, recall={measured[ef]}")
+        return measured[ef]
+
+    chosen = {}
+    for target in sorted(targets):
+        ef = bisect_ef(recall_at, target)
+        logger.info(f"adaptive ef search: target recall {target} -> ef={ef}")
+        chosen.setdefault(ef, target)
+    logger.info(f"adaptive ef search measured {len(measured)} ef values on {len(rows)} queries")
+    return chosen
+
+
+def query(
+    client: weaviate.WeaviateClient,
+    stub,
+    dataset,
+    ef_values,
+    labels,
+    multivector=False,
+    concurrency=(1,),
+    limit=limit,
+    k=None,
+    import_stats=None,
+    selectivities=(None,),
+    profiler=None,
+    target_recalls=None,
+    adaptive_sample=1000,
+    apis=("grpc",),
+    open_loop_rates=None,
+    open_loop_duration=30,
+    arrivals="poisson",
+    nodes=None,
+    batch_sizes=None,
+    multivector_dim=MULTIVECTOR_DIM,
+):
+    """Runs the test set against the current index for every ef and concurrency level.
+
+    `limit` is the number of results requested per query and `k` the cut-off for the
+    reported recall (defaults to `limit`). Recall@1/@10/@100 are added where possible.
+    `import_stats` (e.g. import throughput) is stored alongside every result row.
+    `selectivities` adds filtered runs, restricted to that fraction of the objects with a range
+    filter on `i`, with recall measured against a locally filtered ground truth.
+    With a `profiler` a CPU profile window is captured at the start of every ef step.
+    With `target_recalls` the ef values are not taken from `ef_values` but bisected per
+    target on `adaptive_sample` unfiltered queries, then measured on the full test set.
+    `apis` are measured one after the other at every ef; "grpc_clientless" needs a `stub`
+    (see weaviate_grpc.SearchStub) and skips filtered scenarios. Its rows break the latency
+    down into request encoding, waiting for the reply, server-side search, transport and
+    decoding; with both apis measured, the client rows get the client library overhead.
+    With `open_loop_rates` every ef additionally gets an open-loop sweep of the unfiltered
+    queries at those offered rates (an empty list sweeps up to saturation), stored as api
+    "grpc_async" rows with their `offered_qps`.
+    With `nodes` (see cluster.parse_nodes, the client being connected to the first) the
+    client API queries are spread round-robin across all nodes and the heap is summed up
+    over the nodes.
+    With `batch_sizes` every ef additionally runs the unfiltered queries in groups of that
+    many pipelined requests over the channel of `stub`, stored as api "grpc_pipelined" rows
+    with their `batch_size` and the `batch_speedup` over sending one query at a time.
+    Multivector queries are split into tokens of `multivector_dim`. Their rows report the
+    query token count, the request size and the latency per query token; the latency per
+    token count is stored as "tokens" samples.
+    Returns the run id the results are stored under.
+    """
+    k = k or limit
+    # rows of this call only, every run is stored in its own file
+    results = []
     collection = client.collections.get(class_name)
+    node_clients = [connect(node) for node in (nodes or [])[1:]]
+    if node_clients:
+        collection = BalancedCollection(
+            [collection] + [c.collections.get(class_name) for c in node_clients]
+        )
+    pprof_origins = [node.pprof_origin for node in nodes] if nodes else [PPROF_ORIGIN]
     schema = collection.config.get()
     shards = schema.sharding_config.actual_count
     if not multivector:
         efC = schema.vector_index_config.ef_construction
         m = schema.vector_index_config.max_connections
+        distance = schema.vector_index_config.distance_metric.value
     else:
         efC = schema.vector_config["multivector"].vector_index_config.ef_construction
         m = schema.vector_config["multivector"].vector_index_config.max_connections
+        distance = schema.vector_config["multivector"].vector_index_config.distance_metric.value
     logger.info(f"build params: shards={shards}, efC={efC}, m={m} labels={labels}")
-    vectors = dataset["test"]
+    vectors = load_vectors(dataset["test"], multivector_dim if multivector else None)
+    tokens = None
+    query_stats = {}
+    token_samples = []
     if multivector:
-        vector_dim: int = 128
-        vectors = [torch.from_numpy(sample.reshape(-1, vector_dim)) for sample in vectors]
+        tokens = np.array([len(v) for v in vectors])
+        # the serialized search request, the query is sent as raw float32 bytes either way
+        sizer = stub or SearchStub(class_name, multivector=True)
+        query_stats = {
+            "multivector_dim": multivector_dim,
+            "query_tokens_mean": float(tokens.mean()),
+            "query_bytes_mean": float(np.mean([len(sizer.request(v, limit)) for v in vectors])),
+        }
+        if stub is None:
+            sizer.close()
+    # load the ground truth once instead of reading a row per query inside the timed loop,
+    # datasets without (enough) neighbors get an exact ground truth computed locally
+    gt_k = max([k] + [at for at in RECALL_AT if at <= limit])
+    cache_dir = cache_dir_for(dataset.filename)
+    count = len(dataset["train"])
+    scenarios = []
+    for selectivity in selectivities:
+        filters, matches = selectivity_filter(selectivity, count)
+        if filters is None:
+            neighbors = load_neighbors(dataset, gt_k, distance, cache_dir)
+        else:
+            neighbors, _ = ground_truth(
+                dataset["train"],
+                dataset["test"][:],
+                gt_k,
+                distance,
+                np.arange(count) < matches,
+                cache_dir,
+            )
+        scenarios.append((selectivity, filters, matches, neighbors))
+    unfiltered = next((n for _, filters, _, n in scenarios if filters is None), None)
+    if unfiltered is None and (target_recalls or open_loop_rates is not None or batch_sizes):
+        unfiltered = load_neighbors(dataset, gt_k, distance, cache_dir)
     run_id = f"{int(time.time())}"
 
+    targets = {}
+    if target_recalls:
+        targets = adaptive_ef_values(
+            client,
+            collection,
+            stub,
+            vectors,
+            unfiltered,
+            target_recalls,
+            multivector,
+            limit,
+            k,
+            adaptive_sample,
+        )
+        ef_values = sorted(targets)
+
     for ef in ef_values:
-        for api in ["grpc"]:
-            if not multivector:
-                collection.config.update(
-                    vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(ef=ef)
-                )
-            else:
-                collection.config.update(
-                    vectorizer_config=[
-                        wvc.Reconfigure.NamedVectors.update(
-                            name="multivector",
-                            vector_index_config=wvc.Reconfigure.VectorIndex.hnsw(ef=ef),
+        set_ef(client, collection, ef, multivector)
+        for api in apis:
+            with profiler.cpu_window(ef=ef, api=api) if profiler else nullcontext():
+                for selectivity, filters, matches, neighbors in scenarios:
+                    if api == "grpc_clientless" and filters is not None:
+                        continue
+                    for c in concurrency:
+                        metrics = measure(
+                            api,
+                            client,
+                            collection,
+                            stub,
+                            vectors,
+                            neighbors,
+                            multivector,
+                            c,
+                            limit,
+                            k,
+                            filters,
+                            tokens,
+                        )
+                        for bucket in metrics.pop("token_buckets", []):
+                            token_samples.append(
+                                {"t": time.time(), "api": api, "ef": ef, "concurrency": c, **bucket}
+                            )
+                        heap_mb = -1
+                        try:
+                            heap_mb = sum(obtain_heap_profile(o) for o in pprof_origins)
+                        except:
+                            logger.error("could not obtain heap profile - ignoring")
+                        logger.info(
+                            f"mean={metrics['mean']}, p99={metrics['p99']}, qps={metrics['qps']}, recall={metrics['recall']}, api={api}, ef={ef}, concurrency={c}, selectivity={selectivity}, count={len(vectors)}, heap_mb={heap_mb}"
+                        )
+
+                        results.append(
+                            {
+                                "api": api,
+                                "ef": ef,
+                                "efConstruction": efC,
+                                "maxConnections": m,
+                                "selectivity": selectivity,
+                                "filter_matches": matches,
+                                **({"target_recall": targets[ef]} if ef in targets else {}),
+                                **metrics,
+                                "shards": shards,
+                                "query_nodes": len(pprof_origins),
+                                "heap_mb": heap_mb,
+                                "run_id": run_id,
+                                **query_stats,
+                                **(import_stats or {}),
+                                **labels,
+                            }
                         )
-                    ]
+
+        add_client_overhead([r for r in results if r["ef"] == ef])
+
+        if batch_sizes:
+            single_qps = None
+            for batch_size in sorted(set([1] + list(batch_sizes))):
+                metrics = measure_pipelined(stub, vectors, unfiltered, batch_size, limit, k)
+                single_qps = single_qps or metrics["qps"]
+                metrics["batch_speedup"] = metrics["qps"] / single_qps
+                logger.info(
+                    f"mean={metrics['mean']}, qps={metrics['qps']}, recall={metrics['recall']}, api=grpc_pipelined, ef={ef}, batch_size={batch_size}, speedup={metrics['batch_speedup']}"
+                )
+                results.append(
+                    {
+                        "api": "grpc_pipelined",
+                        "ef": ef,
+                        "efConstruction": efC,
+                        "maxConnections": m,
+                        **({"target_recall": targets[ef]} if ef in targets else {}),
+                        **metrics,
+                        "shards": shards,
+                        "run_id": run_id,
+                        **(import_stats or {}),
+                        **labels,
+                    }
                 )
 
-            wait_for_all_shards_ready(client)
-
-            took = 0
-            recall = 0
-            for i, vec in enumerate(vectors):
-                res = {}
-                if api == "grpc":
-                    res = search_grpc(collection, dataset, i, vec.tolist(), multivector)
-                elif api == "grpc_clientless":
-                    res = search_grpc_clientless(stub, dataset, i, vec)
-                elif api == "graphql":
-                    res = search_graphql(client, dataset, i, vec)
-                else:
-                    logger.error(f"unknown api {api}")
-
-                took += res["took"]
-                recall += res["recall"]
-
-            took = took / len(vectors)
-            recall = recall / len(vectors)
-            heap_mb = -1
-            try:
-                heap_mb = obtain_heap_profile("http://localhost:6060")
-            except:
-                logger.error("could not obtain heap profile - ignoring")
-            logger.info(
-                f"mean={took}, qps={1/took}, recall={recall}, api={api}, ef={ef}, count={len(vectors)}, heap_mb={heap_mb}"
+        if open_loop_rates is not None:
+            points = sweep(
+                vectors,
+                unfiltered,
+                open_loop_rates,
+                open_loop_duration,
+                limit,
+                k,
+                multivector,
+                arrivals,
+                class_name,
+                nodes=nodes,
             )
+            for point in points:
+                results.append(
+                    {
+                        "api": "grpc_async",
+                        "ef": ef,
+                        "efConstruction": efC,
+                        "maxConnections": m,
+                        **({"target_recall": targets[ef]} if ef in targets else {}),
+                        **point,
+                        "shards": shards,
+                        "run_id": run_id,
+                        **(import_stats or {}),
+                        **labels,
+                    }
+                )
 
-            results.append(
-                {
-                    "api": api,
-                    "ef": ef,
-                    "efConstruction": efC,
-                    "maxConnections": m,
-                    "mean": took,
-                    "qps": 1 / took,
-                    "recall": recall,
-                    "shards": shards,
-                    "heap_mb": heap_mb,
-                    "run_id": run_id,
-                    **labels,
-                }
-            )
+    for c in node_clients:
+        c.close()
 
-    filename = f"./results/{run_id}.json"
-    logger.info(f"storing results in {filename}")
-    with open(filename, "w") as f:
-        f.write(json.dumps(results))
+    store_run(run_id, rows=results)
+    if token_samples:
+        store_token_samples(run_id, token_samples)
     logger.info("done storing results")
+    return run_id
+
+
+def store_token_samples(run_id, samples, path="./results"):
+    store_run(run_id, "multivector", samples={"token_samples": samples}, path=path)